@@ -1,15 +1,27 @@
 # CA目标检测数据集格式转换为YOLO数据集格式脚本
 
-import glob
+import os
+import sys
 import json
+import zlib
 import shutil
 import logging
+import tempfile
 import argparse
+import numpy as np
 from tqdm import tqdm
+from typing import Union
 from pathlib import Path
 from PIL import Image, ImageDraw
+from multiprocessing.pool import Pool
 
-# from multiprocessing.pool import Pool
+try:
+    import cv2
+except ImportError:  # ^ 仅mask_backend为cv2时需要
+    cv2 = None
+
+sys.path.append(str(Path(__file__).resolve().parents[1].joinpath("Object")))
+from label_schema import LabelSchema, load_label_dicts
 
 logging.basicConfig(format="%(levelname)s:%(message)s", level=logging.INFO)
 
@@ -26,7 +38,8 @@ IMG_FORMATS = [
     "mpo",
 ]  # 支持的图像后缀名
 LABEL_FORMATS = ["txt"]
-# NUM_THREADS = min(8, os.cpu_count())  # number of multiprocessing threads
+NUM_THREADS = min(8, os.cpu_count())  # number of multiprocessing threads
+MAX_OPEN_LABELS = 256  # 合并标签时同时打开的标签文件数量上限
 
 # ^ 以下定义根据CA标注需求和识别需求说明书定义,相关定义修改需严格遵照实际的需求和相关定义修改(常年根据实际情况改变)
 # ID代表实例类别,TrainID代表参与训练的ID(-1代表不参与训练),TypeID表示类别ID
@@ -176,14 +189,470 @@ LANE_DICT = {
 }
 
 
-def _categorys_count_init(categorys_dict: dict = OBJECT_DICT) -> dict:
+def _multi_task_schemas(schema_file: Union[str, None] = None) -> tuple:
+    """
+    编译目标检测、语义分割和车道线的标签定义
+
+    Args:
+        schema_file: 外部YAML定义文件,包含OBJECT_DICT,SEMANTICS_DICT和LANE_DICT(可选),为None时使用本文件中的定义
+
+    Returns:
+        (object_schema, semantics_schema, lane_schema)
+    """
+    label_dicts = {}
+    if schema_file is not None:
+        label_dicts = load_label_dicts(schema_file)
+    return (
+        LabelSchema(label_dicts.get("OBJECT_DICT", OBJECT_DICT)),
+        LabelSchema(label_dicts.get("SEMANTICS_DICT", SEMANTICS_DICT)),
+        LabelSchema(label_dicts.get("LANE_DICT", LANE_DICT)),
+    )
+
+
+MASK_BACKENDS = ["pil", "cv2"]  # 语义分割图的绘制方式
+
+_SCHEMAS = None  # 进程内编译后的标签定义,由_init_worker设置
+_MASK_OPTIONS = ("pil", 6, False)  # 进程内的语义分割图绘制方式,PNG压缩等级和是否为调色板模式
+
+
+def _init_worker(schemas: tuple, mask_options: tuple = ("pil", 6, False)) -> None:
+    """
+    进程池初始化,每个进程只接收一次编译后的标签定义和语义分割图的输出设置
+    """
+    global _SCHEMAS, _MASK_OPTIONS
+    _SCHEMAS = schemas
+    _MASK_OPTIONS = mask_options
+
+
+def _mask_palette() -> list:
+    """
+    调色板模式PNG使用的颜色表(与PASCAL VOC一致),像素值仍然为train id,仅便于直接查看
+    """
+    palette = []
+    for i in range(256):
+        r = g = b = 0
+        c = i
+        for j in range(8):
+            r |= ((c >> 0) & 1) << (7 - j)
+            g |= ((c >> 1) & 1) << (7 - j)
+            b |= ((c >> 2) & 1) << (7 - j)
+            c >>= 3
+        palette.extend((r, g, b))
+    return palette
+
+
+MASK_PALETTE = _mask_palette()
+
+
+def _rasterize_semantics(
+    polygons: list, width: int, height: int, backend: str = "pil"
+) -> Image.Image:
+    """
+    按照标注顺序绘制一张图像中所有的语义分割多边形,后绘制的覆盖先绘制的,每个多边形的边界绘制为1
+
+    Args:
+        polygons: [(xy, train_id)],xy为[(x, y), ...]
+        width: 图像宽度
+        height: 图像高度
+        backend: pil使用ImageDraw逐个绘制(与原先输出完全一致);
+                 cv2一次性将所有坐标转换为int32数组后在同一块numpy内存上绘制,速度更快,边缘像素与pil略有差异
+
+    Returns:
+        mask: L模式的语义分割图
+    """
+    if backend == "cv2":
+        mask = np.zeros((height, width), dtype=np.uint8)
+        if polygons:
+            points = np.rint(
+                np.concatenate([np.asarray(xy, dtype=np.float64) for xy, _ in polygons])
+            ).astype(np.int32)
+            splits = np.cumsum([len(xy) for xy, _ in polygons])[:-1]
+            # ^ cv2.fillPoly一次绘制多个多边形时使用奇偶规则,重叠部分会被挖空,因此按顺序逐个填充
+            for pts, (_, train_id) in zip(np.split(points, splits), polygons):
+                cv2.fillPoly(mask, [pts], train_id)
+                cv2.polylines(mask, [pts], True, 1)
+        return Image.fromarray(mask, "L")
+
+    mask = Image.new("L", (width, height), 0)
+    draw = ImageDraw.Draw(mask)
+    for xy, train_id in polygons:
+        draw.polygon(xy, outline=1, fill=train_id)
+    return mask
+
+
+def _save_mask(
+    mask: Image.Image, mask_path: str, compress_level: int = 6, palette: bool = False
+) -> None:
+    """
+    保存语义分割PNG
+
+    Args:
+        mask: L模式的语义分割图
+        mask_path: 保存路径
+        compress_level: PNG的zlib压缩等级,0-9,越小越快文件越大
+        palette: 是否保存为调色板(P)模式,像素值不变
+    """
+    if palette:
+        mask = mask.copy()
+        mask.putpalette(MASK_PALETTE)  # ^ L模式添加调色板后转换为P模式
+    mask.save(mask_path, compress_level=compress_level)
+
+
+def _multi_task_image(args: tuple) -> tuple:
+    """
+    处理单张图像的多任务标签:复制图像,写入YOLOv5标签,语义分割PNG和车道线json,供多进程调用
+
+    Args:
+        args: (融合后的标签json, [原始路径名称,复制路径名称,目标标签名称,处理语义分割图名称,处理车道线名称])
+
+    Returns:
+        (object_counts, semantics_counts, lane_counts): 该图像中各类别的数量
+    """
+    label_json, image_paths = args
+    object_schema, semantics_schema, lane_schema = _SCHEMAS
+    object_indices, semantics_indices, lane_indices = [], [], []  # 类别统计
+    elements = label_json["result"][0]["elements"]
+    width = label_json["result"][0]["size"]["width"]
+    height = label_json["result"][0]["size"]["height"]
+    object_str = ""
+    polygons = []  # 语义分割多边形,按照标注顺序统一绘制
+    lane_dict = {
+        "imageHeight": height,
+        "imageWidth": width,
+        "shapes": [],
+    }  #! 倪光一数据格式定义
+    for label in elements:
+        mark_type = label["markType"]
+        for label_name in label["attribute"].values():  # 这里的属性值标注存在很多,名称只是其中之一
+            # 目标检测
+            if mark_type == "rect":  # 确保标注的是矩形框
+                index = object_schema.index.get(label_name)
+                if index is None:
+                    continue
+                object_indices.append(index)
+                train_id = object_schema.train_id(index)  # ^ 获取train id
+                if train_id != -1:
+                    w = label["width"] / width
+                    h = label["height"] / height
+                    x_central = label["posX"] / width + w / 2
+                    y_central = label["posY"] / height + h / 2
+                    object_str = (
+                        object_str
+                        + str(train_id)
+                        + " "
+                        + " ".join(
+                            (
+                                "%.6f" % x_central,
+                                "%.6f" % y_central,
+                                "%.6f" % w,
+                                "%.6f" % h,
+                            )
+                        )
+                        + "\n"
+                    )  # ^ YOLOv5格式
+            # 语义分割
+            elif mark_type == "area":  # 确保标注的是区域
+                index = semantics_schema.index.get(label_name)
+                if index is None:
+                    continue
+                semantics_indices.append(index)
+                train_id = semantics_schema.train_id(index)
+                if train_id != -1:
+                    xy = [(point["x"], point["y"]) for point in label["points"]]
+                    assert len(xy) > 2, "Semantics must have points more than 2"
+                    polygons.append((xy, train_id))
+            # TODO 车道线(当前车道线采用的数据格式是倪光一自定义格式,没有管理trainid的相关情况后续迭代修改)
+            elif mark_type == "line":  # 确保标注的是线
+                index = lane_schema.index.get(label_name)
+                if index is None:
+                    continue
+                lane_indices.append(index)
+                lane_dict["shapes"].append(
+                    {"type": label_name, "points": label["points"]}
+                )
+    # 分别写入数据
+    # 复制图像
+    shutil.copy(image_paths[0], image_paths[1])
+    # YOLOv5标签
+    with open(image_paths[2], "w", encoding="utf-8") as f:
+        f.write(object_str)
+    # 语义分割PNG
+    backend, compress_level, palette = _MASK_OPTIONS
+    mask = _rasterize_semantics(polygons, width, height, backend)
+    _save_mask(mask, image_paths[3], compress_level, palette)
+    # 车道线格式转换
+    with open(image_paths[4], "w", encoding="utf-8") as f:
+        json.dump(lane_dict, f)
+    return (
+        object_schema.bincount(object_indices),
+        semantics_schema.bincount(semantics_indices),
+        lane_schema.bincount(lane_indices),
+    )
+
+
+def _walk_dataset(input_path: Path) -> tuple:
     """
-    初始化类别统计
+    使用os.scandir遍历一次整个目录树,遍历时直接根据后缀名将文件分为图像和标签,与glob一样跳过以.开头的隐藏文件和目录
+
+    Args:
+        input_path: 整体数据集保存的路径
+
+    Returns:
+        (dirs, images, labels): dirs为{目录路径: mtime_ns},images和labels为排序后的文件路径
+    """
+    img_formats, label_formats = set(IMG_FORMATS), set(LABEL_FORMATS)
+    dirs, images, labels = {}, [], []
+    stack = [str(input_path)]
+    while stack:
+        dir_path = stack.pop()
+        dirs[dir_path] = os.stat(dir_path).st_mtime_ns
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir():
+                    stack.append(entry.path)
+                    continue
+                suffix = entry.name.rsplit(".", 1)[-1].lower()
+                if suffix in img_formats:
+                    images.append(entry.path)
+                elif suffix in label_formats:
+                    labels.append(entry.path)
+    return dirs, sorted(images), sorted(labels)
+
+
+def _scan_dataset(
+    input_path: Path, cache_file: Union[Path, None] = None, rescan: bool = False
+) -> tuple:
+    """
+    获取数据集中所有的图像和标签路径,结果连同所有目录的mtime保存在cache_file中,
+    再次运行时若所有目录的mtime均未改变(没有增删文件),则直接读取缓存而不再遍历目录树
+
+    Args:
+        input_path: 整体数据集保存的路径
+        cache_file: 缓存文件路径,为None时不使用缓存
+        rescan: 是否忽略已有的缓存重新遍历目录树(遍历结果仍然写入cache_file)
+
+    Returns:
+        (images, labels): 排序后的图像路径和标签路径
+    """
+    if cache_file is not None and not rescan and cache_file.exists():
+        try:
+            with open(cache_file, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+            if cache["root"] == str(input_path) and all(
+                os.stat(dir_path).st_mtime_ns == mtime
+                for dir_path, mtime in cache["dirs"].items()
+            ):
+                logging.info("Using the discovery cache %s" % str(cache_file))
+                return cache["images"], cache["labels"]
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            # ^ 目录已经被删除或缓存文件损坏,重新遍历
+            logging.warning("Discovery cache %s is invalid, rescanning" % cache_file)
+
+    logging.info("Searching the images and labels in %s" % str(input_path))
+    dirs, images, labels = _walk_dataset(input_path)
+    if cache_file is not None:
+        # 先写临时文件再替换,中断时不会留下写了一半的缓存
+        tmp_file = cache_file.with_name(cache_file.name + ".%d.tmp" % os.getpid())
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "root": str(input_path),
+                    "dirs": dirs,
+                    "images": images,
+                    "labels": labels,
+                },
+                f,
+            )
+        os.replace(tmp_file, cache_file)
+    return images, labels
+
+
+def _multi_task_image_safe(args: tuple) -> tuple:
+    """
+    处理单张图像,出错时不中断整体转换,而是返回错误信息,便于将该图像放入隔离列表
+
+    Args:
+        args: (修改后的唯一名称, _multi_task_image的参数)
+
+    Returns:
+        (stem_name, counts, error): 成功时error为None,失败时counts为None
     """
-    categorys_count = {}
-    for key in categorys_dict.keys():
-        categorys_count[key] = 0
-    return categorys_count
+    stem_name, task = args
+    try:
+        return stem_name, _multi_task_image(task), None
+    except Exception as e:
+        return stem_name, None, f"{type(e).__name__}: {e}"
+
+
+def _journal_line(stem_name: str, counts: tuple) -> str:
+    """
+    日志中的一行:完成的图像名称和该图像各任务的非零类别数量[[索引, 数量], ...]
+    """
+    return (
+        json.dumps(
+            {
+                "stem": stem_name,
+                "counts": [
+                    [[int(i), int(count[i])] for i in np.flatnonzero(count)]
+                    for count in counts
+                ],
+            },
+            ensure_ascii=False,
+        )
+        + "\n"
+    )
+
+
+def _journal_header(count_names: list) -> str:
+    """
+    日志的第一行:各任务统计的类别名称,类别数量按照其中的索引保存,resume时用于检查schema是否一致
+    """
+    return json.dumps({"count_names": count_names}, ensure_ascii=False) + "\n"
+
+
+def _read_journal(journal_file: Path, counts: list, count_names: list) -> set:
+    """
+    读取只追加的完成日志,将其中的类别数量累加到counts,中断时最后写了一半的行会被截断,之后继续追加
+
+    Args:
+        journal_file: 日志文件路径
+        counts: 各任务的类别数量数组(原地累加)
+        count_names: 当前各任务统计的类别名称,与日志头部不一致时拒绝resume
+
+    Returns:
+        done: 已经完成的图像名称
+    """
+    done = set()
+    offset = 0  # 最后一个完整行的结束位置
+    with open(journal_file, "rb+") as f:
+        for oneline in f:
+            if not oneline.endswith(b"\n"):
+                break
+            record = json.loads(oneline)
+            if offset == 0:  # 头部
+                if record.get("count_names") != count_names:
+                    raise Exception(
+                        f"ERROR: {str(journal_file)} was written with another schema, "
+                        "can not resume from it"
+                    )
+                offset += len(oneline)
+                continue
+            offset += len(oneline)
+            if record["stem"] in done:
+                continue
+            done.add(record["stem"])
+            for count, pairs in zip(counts, record["counts"]):
+                for i, c in pairs:
+                    count[i] += c
+        f.truncate(offset)
+    return done
+
+
+def _label_stem_name(url_path: str) -> str:
+    """
+    由百度标注的路径得到与图像一致的名称,父目录最后'_'分割后为摄像头名称时加上摄像头前缀
+    """
+    url_path = Path(url_path)
+    parent_dir_last = url_path.parent.name.split("_")[-1]
+    if "cam" in parent_dir_last:
+        return parent_dir_last + "_" + url_path.name
+    return url_path.name
+
+
+def _partition_labels(
+    labels: list, partition_path: Path, partitions: int, stem_names
+) -> tuple:
+    """
+    第一遍扫描标签文件,不解析json,只将每一行的(图像名称, 标签文件序号, 行偏移)按照名称的哈希值写入分区文件,
+    同一图像的所有标签行必然落在同一分区,且保持标签文件和行的先后顺序
+
+    Args:
+        labels: 标签文件路径列表
+        partition_path: 分区文件保存的目录
+        partitions: 分区数量
+        stem_names: 需要处理的图像名称(不在其中的标签行不写入分区)
+
+    Returns:
+        (partition_files, total): 分区文件路径列表和需要处理的图像数量
+    """
+    partition_files = [
+        partition_path.joinpath("%04d.txt" % i) for i in range(partitions)
+    ]
+    labelled = set()  # 有标签的图像名称,用于进度条的总数
+    outputs = [open(x, "w", encoding="utf-8") for x in partition_files]
+    try:
+        for i, x in enumerate(
+            tqdm(labels, desc="Partitioning the label lines!", unit="labels")
+        ):
+            offset = 0
+            with open(x, "rb") as f:
+                for oneline in f:
+                    if oneline.startswith(b"http"):
+                        stem_name = _label_stem_name(
+                            oneline.split(maxsplit=1)[0].decode("utf-8")
+                        )  # 百度标注的路径
+                        if stem_name in stem_names:  # 存在标签不一致的情况
+                            labelled.add(stem_name)
+                            outputs[
+                                zlib.crc32(stem_name.encode("utf-8")) % partitions
+                            ].write("%s\t%d\t%d\n" % (stem_name, i, offset))
+                    offset += len(oneline)
+    finally:
+        for f in outputs:
+            f.close()
+    return partition_files, len(labelled)
+
+
+def _merge_partition(partition_file: Path, labels: list, stem_names) -> dict:
+    """
+    合并一个分区内的标签行,同一图像的多行标签按照先后顺序拼接elements,只有该分区的json会被读入内存
+
+    Args:
+        partition_file: 分区文件路径
+        labels: 标签文件路径列表,与分区文件中的标签文件序号对应
+        stem_names: 需要合并的图像名称(不在其中的标签行不解析)
+
+    Returns:
+        {图像名称: 合并后的标签json}
+    """
+    locations = {}
+    with open(partition_file, "r", encoding="utf-8") as f:
+        for oneline in f:
+            stem_name, label_index, offset = oneline.rsplit("\t", 2)
+            if stem_name in stem_names:  # 存在标签不一致的情况
+                locations.setdefault(stem_name, []).append(
+                    (int(label_index), int(offset))
+                )
+
+    label_dict = {}
+    handles = {}
+    try:
+        for stem_name, lines in locations.items():
+            elements = []
+            for label_index, offset in lines:
+                if label_index not in handles:
+                    if len(handles) >= MAX_OPEN_LABELS:  # 避免超出打开文件数量的限制
+                        for f in handles.values():
+                            f.close()
+                        handles.clear()
+                    handles[label_index] = open(labels[label_index], "rb")
+                f = handles[label_index]
+                f.seek(offset)
+                _, _, label_json = f.readline().decode("utf-8").split(
+                    maxsplit=2
+                )  # 百度标注的路径, 文件名称, 标签信息
+                label_json = json.loads(label_json)
+                if stem_name not in label_dict:
+                    label_dict[stem_name] = label_json
+                    elements = label_json["result"][0]["elements"]
+                else:
+                    elements.extend(label_json["result"][0]["elements"])
+    finally:
+        for f in handles.values():
+            f.close()
+    return label_dict
 
 
 def CA_multi_task_label(
@@ -194,6 +663,15 @@ def CA_multi_task_label(
     labels_lane: str = "labels_lane",
     labels_obj: str = "labels_obj",
     labels_semantic: str = "labels_semantic",
+    schema_file: Union[str, None] = None,
+    workers: int = NUM_THREADS,
+    scan_cache: Union[str, None] = ".discovery_cache.json",
+    rescan: bool = False,
+    mask_backend: str = "pil",
+    mask_compress_level: int = 6,
+    mask_palette: bool = False,
+    resume: bool = False,
+    partitions: int = 64,
 ) -> None:
     """
     CA数据集的多任务联合标注标签处理,输出的标签包括目标检测、语义分割和车道线识别标签
@@ -206,6 +684,15 @@ def CA_multi_task_label(
         labels_lane: output_path路径下保存车道线标签的目录名
         labels_obj: output_path路径下保存目标检测标签的目录名
         labels_semantic: output_path路径下保存语义分割标签的目录名
+        schema_file: 外部YAML标签定义文件,为None时使用本文件中的定义
+        workers: 处理图像的进程数,小于等于1时在当前进程中处理
+        scan_cache: output_path路径下保存文件搜寻结果缓存的文件名,为None时每次都遍历整个目录树
+        rescan: 是否忽略已有的文件搜寻缓存重新遍历整个目录树,并用遍历结果更新缓存
+        mask_backend: 语义分割图的绘制方式,pil或cv2
+        mask_compress_level: 语义分割PNG的压缩等级,0-9
+        mask_palette: 语义分割PNG是否保存为调色板模式
+        resume: 是否根据output_path下的完成日志跳过已经完成的图像,继续之前中断的转换
+        partitions: 标签合并时的分区数量,标签越多分区越多,每次合并占用的内存越少
 
     Returns:
         None
@@ -213,6 +700,10 @@ def CA_multi_task_label(
     input_path = Path(input_path).resolve()
     if not input_path.is_dir():
         raise Exception(f"ERROR: {str(input_path)} is not a dir")
+    if mask_backend == "cv2" and cv2 is None:
+        raise Exception("ERROR: mask_backend cv2 needs opencv-python installed")
+    if partitions < 1:
+        raise Exception("ERROR: partitions must be at least 1")
 
     # 创建路径
     output_path = Path(output_path).resolve()
@@ -227,11 +718,9 @@ def CA_multi_task_label(
     semantic_path.mkdir(exist_ok=True)
 
     # 图像和标签搜寻
-    files = sorted(
-        glob.glob(str(input_path.joinpath(input_path, "**")), recursive=True)
-    )
-    images = [x for x in files if x.split(".")[-1].lower() in IMG_FORMATS]  # 图像路径
-    labels = [x for x in files if x.split(".")[-1].lower() in LABEL_FORMATS]  # 标签路径
+    images, labels = _scan_dataset(
+        input_path, output_path.joinpath(scan_cache) if scan_cache else None, rescan
+    )  # 图像路径, 标签路径
 
     # 图像处理
     images_dict = {}
@@ -258,123 +747,95 @@ def CA_multi_task_label(
             }
         )  # 修改后的唯一名称: 原始路径名称,复制路径名称,目标标签名称,处理语义分割图名称,处理车道线名称
 
-    # 标签处理
-    label_dict = {}
-    for x in tqdm(labels, desc="Fusing three kinds of label to one!", unit="labels"):
-        with open(x, "r", encoding="utf-8") as f:
-            for oneline in f.readlines():
-                if oneline.startswith("http"):
-                    url_path, _, label_json = oneline.split(
-                        maxsplit=2
-                    )  # 百度标注的路径, 文件名称, 标签信息
-                    label_json = json.loads(label_json)
-                    url_path = Path(url_path)
-                    parent_dir_last = url_path.parent.name.split("_")[-1]
-                    if "cam" in parent_dir_last:
-                        stem_name = parent_dir_last + "_" + url_path.name
-                    else:
-                        stem_name = url_path.name
-                    if stem_name not in label_dict.keys():
-                        label_dict.update({stem_name: label_json})
-                    else:
-                        label_dict[stem_name]["result"][0]["elements"] = (
-                            label_dict[stem_name]["result"][0]["elements"]
-                            + label_json["result"][0]["elements"]
-                        )
-
     # 整体数据处理
-    object_count = _categorys_count_init(OBJECT_DICT)
-    semantics_count = _categorys_count_init(SEMANTICS_DICT)
-    lane_count = _categorys_count_init(LANE_DICT)
-
-    # TODO 多进程提升效率
-    for x in tqdm(
-        label_dict.keys(),
-        desc="Copying the image and Processing the corresponding task label!",
-        unit="imgs",
-    ):
-        if x in images_dict.keys():  # 存在标签不一致的情况
-            elements = label_dict[x]["result"][0]["elements"]
-            width = label_dict[x]["result"][0]["size"]["width"]
-            height = label_dict[x]["result"][0]["size"]["height"]
-            object_str = ""
-            mask = Image.new("L", (width, height), 0)
-            draw = ImageDraw.Draw(mask)
-            lane_dict = {
-                "imageHeight": height,
-                "imageWidth": width,
-                "shapes": [],
-            }  #! 倪光一数据格式定义
-            for label in elements:
-                for label_name in label["attribute"].values():  # 这里的属性值标注存在很多,名称只是其中之一
-                    # 目标检测
-                    if (
-                        label_name in OBJECT_DICT.keys() and label["markType"] == "rect"
-                    ):  # 确保标注的是矩形框
-                        train_id = OBJECT_DICT[label_name]["train_id"]  # ^ 获取train id
-                        object_count[label_name] += 1
-                        if train_id != -1:
-                            w = label["width"] / width
-                            h = label["height"] / height
-                            x_central = label["posX"] / width + w / 2
-                            y_central = label["posY"] / height + h / 2
-                            object_str = (
-                                object_str
-                                + str(train_id)
-                                + " "
-                                + " ".join(
-                                    (
-                                        "%.6f" % x_central,
-                                        "%.6f" % y_central,
-                                        "%.6f" % w,
-                                        "%.6f" % h,
-                                    )
-                                )
-                                + "\n"
-                            )  # ^ YOLOv5格式
-                    # 语义分割
-                    elif (
-                        label_name in SEMANTICS_DICT.keys()
-                        and label["markType"] == "area"
-                    ):  # 确保标注的是区域
-                        train_id = SEMANTICS_DICT[label_name]["train_id"]
-                        semantics_count[label_name] += 1
-                        if train_id != -1:
-                            xy = [(point["x"], point["y"]) for point in label["points"]]
-                            assert len(xy) > 2, "Semantics must have points more than 2"
-                            draw.polygon(xy, outline=1, fill=train_id)
-                    # TODO 车道线(当前车道线采用的数据格式是倪光一自定义格式,没有管理trainid的相关情况后续迭代修改)
-                    elif (
-                        label_name in LANE_DICT.keys() and label["markType"] == "line"
-                    ):  # 确保标注的是线
-                        lane_count[label_name] += 1
-                        lane_dict["shapes"].append(
-                            {"type": label_name, "points": label["points"]}
-                        )
-            # 分别写入数据
-            # 复制图像
-            shutil.copy(images_dict[x][0], images_dict[x][1])
-            # YOLOv5标签
-            with open(images_dict[x][2], "w", encoding="utf-8") as f:
-                f.write(object_str)
-            # 语义分割PNG
-            mask.save(images_dict[x][3])
-            # 车道线格式转换
-            with open(images_dict[x][4], "w", encoding="utf-8") as f:
-                json.dump(lane_dict, f)
+    object_schema, semantics_schema, lane_schema = _multi_task_schemas(schema_file)
+
+    # 整图多进程处理,各进程返回类别数量,最后汇总
+    schemas = (object_schema, semantics_schema, lane_schema)
+    mask_options = (mask_backend, mask_compress_level, mask_palette)
+    counts = [np.zeros(len(schema.count_names), dtype=np.int64) for schema in schemas]
+    count_names = [list(schema.count_names) for schema in schemas]
+
+    # 完成日志与隔离列表,resume时跳过日志中已经完成的图像并从日志恢复类别数量
+    journal_file = output_path.joinpath(".multi_task_journal.jsonl")
+    quarantine_file = output_path.joinpath("quarantine.txt")
+    done = set()
+    if resume and journal_file.exists():
+        done = _read_journal(journal_file, counts, count_names)
+        logging.info(f"Resuming: {len(done)} images finished")
+    elif journal_file.exists():
+        journal_file.unlink()
+    if quarantine_file.exists():  # 上次出错的图像不在日志中,会重新处理
+        quarantine_file.unlink()
+    stem_names = images_dict.keys() - done
+    quarantine = 0
+    quarantine_f = None  # 第一次出错时才创建隔离列表
+
+    # 标签处理,外部归并:先将标签行的位置按照图像名称的哈希值写入分区文件,再逐个分区合并标签并处理图像,
+    # 内存中只保存一个分区的json
+    desc = "Copying the image and Processing the corresponding task label!"
+    if workers <= 1:
+        _init_worker(schemas, mask_options)
+    pool = (
+        Pool(workers, initializer=_init_worker, initargs=(schemas, mask_options))
+        if workers > 1
+        else None
+    )
+    try:
+        with tempfile.TemporaryDirectory(
+            prefix=".label_partitions_", dir=output_path
+        ) as partition_path, open(journal_file, "a", encoding="utf-8") as journal:
+            if journal.tell() == 0:
+                journal.write(_journal_header(count_names))
+            partition_files, total = _partition_labels(
+                labels, Path(partition_path), partitions, stem_names
+            )
+            pbar = tqdm(desc=desc, total=total, unit="imgs")
+            for partition_file in partition_files:
+                label_dict = _merge_partition(partition_file, labels, stem_names)
+                tasks = [
+                    (x, (label_dict[x], images_dict[x])) for x in label_dict.keys()
+                ]
+                if pool:
+                    results = pool.imap_unordered(
+                        _multi_task_image_safe, tasks, chunksize=16
+                    )
+                else:
+                    results = map(_multi_task_image_safe, tasks)
+                for stem_name, image_counts, error in results:
+                    pbar.update(1)
+                    if error is not None:  # 出错的图像放入隔离列表,不中断转换
+                        quarantine += 1
+                        if quarantine_f is None:
+                            quarantine_f = open(quarantine_file, "w", encoding="utf-8")
+                        quarantine_f.write(stem_name + "\t" + error + "\n")
+                        quarantine_f.flush()
+                        continue
+                    for count, image_count in zip(counts, image_counts):
+                        count += image_count
+                    journal.write(_journal_line(stem_name, image_counts))
+                    journal.flush()
+            pbar.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if quarantine_f is not None:
+            quarantine_f.close()
+    if quarantine:
+        logging.warning(
+            f"{quarantine} images failed, see {str(quarantine_file)} for details"
+        )
 
     # 统计数量输出
     logging.info("Outputing the number statistics!")
     with open(count_output_file, "w", encoding="utf-8") as f:
-        f.write("目标检测统计\n")
-        for key in sorted(object_count.keys()):
-            f.write(key + ":" + str(object_count[key]) + "\n")
-        f.write("\n语义分割统计\n")
-        for key in sorted(semantics_count.keys()):
-            f.write(key + ":" + str(semantics_count[key]) + "\n")
-        f.write("\n车道线统计\n")
-        for key in sorted(lane_count.keys()):
-            f.write(key + ":" + str(lane_count[key]) + "\n")
+        for title, schema, count in zip(
+            ("目标检测统计\n", "\n语义分割统计\n", "\n车道线统计\n"), schemas, counts
+        ):
+            f.write(title)
+            count_dict = schema.count_dict(count)
+            for key in sorted(schema.names):
+                f.write(key + ":" + str(count_dict[key]) + "\n")
 
     logging.info("All Finish! (*╹▽╹*),HaHa~")
 
@@ -409,6 +870,79 @@ if __name__ == "__main__":
         help="The output name to save quantity statistics infomation",
         metavar="CA_count_output_path",
     )
+    parser.add_argument(
+        "-s",
+        "--schema_file",
+        type=str,
+        default=None,
+        help="The YAML file of OBJECT_DICT/SEMANTICS_DICT/LANE_DICT label definition, use the definition in this file if not set",
+        metavar="schema_file",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=NUM_THREADS,
+        help="number of processes to handle images",
+        metavar="workers",
+    )
+    parser.add_argument(
+        "-rs",
+        "--rescan",
+        action="store_true",
+        help="ignore the discovery cache and walk the whole dataset dir, then refresh the cache",
+    )
+    parser.add_argument(
+        "-mb",
+        "--mask_backend",
+        type=str,
+        default="pil",
+        choices=MASK_BACKENDS,
+        help="semantic mask rasterization backend, cv2 is faster but edges differ slightly from pil",
+    )
+    parser.add_argument(
+        "-mc",
+        "--mask_compress_level",
+        type=int,
+        default=6,
+        choices=range(10),
+        help="semantic mask PNG compression level, lower is faster and bigger",
+        metavar="0-9",
+    )
+    parser.add_argument(
+        "-mp",
+        "--mask_palette",
+        action="store_true",
+        help="save semantic mask PNG in palette mode (pixel values are still train ids)",
+    )
+    parser.add_argument(
+        "-r",
+        "--resume",
+        action="store_true",
+        help="skip the images finished in the last run and rebuild the statistics from its journal",
+    )
+    parser.add_argument(
+        "-np",
+        "--partitions",
+        type=int,
+        default=64,
+        help="number of partitions to merge the labels, more partitions use less memory",
+        metavar="partitions",
+    )
     opt = parser.parse_args()
+    if opt.partitions < 1:
+        parser.error("argument -np/--partitions: must be at least 1")
 
-    CA_multi_task_label(opt.input_path, opt.output_path, opt.count_output_file)
+    CA_multi_task_label(
+        opt.input_path,
+        opt.output_path,
+        opt.count_output_file,
+        schema_file=opt.schema_file,
+        workers=opt.workers,
+        rescan=opt.rescan,
+        mask_backend=opt.mask_backend,
+        mask_compress_level=opt.mask_compress_level,
+        mask_palette=opt.mask_palette,
+        resume=opt.resume,
+        partitions=opt.partitions,
+    )
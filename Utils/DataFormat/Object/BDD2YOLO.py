@@ -1,12 +1,20 @@
 # BDD数据集格式转换为YOLO的xywh格式
 
 import os
+import ast
+import sys
 import json
 import shutil
 import logging
 import argparse
 from tqdm import tqdm
+from pathlib import Path
+from itertools import groupby, islice, repeat
+from collections import deque
+from multiprocessing.pool import Pool
+from typing import Iterable, Iterator, Union
 
+NUM_THREADS = min(8, os.cpu_count())  # number of multiprocessing threads
 logging.basicConfig(format="%(levelname)s:%(message)s", level=logging.INFO)
 
 TRAFFIC_LIGHT = [
@@ -17,12 +25,555 @@ TRAFFIC_LIGHT = [
 ]  # 交通灯命名的格式，可根据实际的需求修改
 
 
+def _bdd_json_stream(json_path: str, chunk_size: int = 1 << 20) -> Iterator[dict]:
+    """
+    增量解析BDD标签json文件顶层数组,每次只返回一帧的标签字典,内存占用只与单帧大小和chunk_size有关
+
+    Args:
+        json_path: bdd标签json文件路径
+        chunk_size: 每次从文件读取的字符数
+
+    Returns:
+        每一帧标签对应的字典(生成器)
+    """
+    decoder = json.JSONDecoder()
+    with open(json_path) as f:
+        buf = f.read(chunk_size)
+        pos = buf.find("[")
+        while pos == -1:  # 寻找顶层数组的起始位置
+            chunk = f.read(chunk_size)
+            if not chunk:
+                raise ValueError("%s is not a json array file" % json_path)
+            buf += chunk
+            pos = buf.find("[")
+        pos += 1
+        eof = False
+        while True:
+            # 跳过元素之间的空白和逗号
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf) and buf[pos] == "]":
+                return
+            try:
+                if pos >= len(buf):
+                    raise ValueError("need more data")
+                datum, pos = decoder.raw_decode(buf, pos)
+            except ValueError:  # 当前缓存中不是完整的一帧,继续读取
+                if eof:
+                    raise ValueError("%s is truncated" % json_path)
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+            yield datum
+
+
+def _bdd_json_load(json_path: str, stream: bool = False) -> Iterable[dict]:
+    """
+    读取BDD标签json文件
+
+    Args:
+        json_path: bdd标签json文件路径
+        stream: 是否使用增量解析,避免整体读取json文件带来的内存占用
+
+    Returns:
+        每一帧标签对应的字典序列
+    """
+    if stream:
+        return _bdd_json_stream(json_path)
+    with open(json_path) as f:
+        j = f.read()
+    return json.loads(j)
+
+
+class _BDDFilterNamespace(dict):
+    """
+    过滤表达式的变量空间,不存在的属性返回None而不是抛出NameError
+    """
+
+    def __missing__(self, key):
+        return None
+
+
+# 过滤表达式允许的语法节点:比较,布尔运算,not/负号,变量名与常量(以及in使用的常量元组和列表),
+# 不允许属性访问,下标和函数调用等,避免表达式访问对象内部
+_BDD_FILTER_NODES = tuple(
+    getattr(ast, name)
+    for name in (
+        "Expression",
+        "BoolOp",
+        "And",
+        "Or",
+        "UnaryOp",
+        "Not",
+        "USub",
+        "Compare",
+        "Eq",
+        "NotEq",
+        "Lt",
+        "LtE",
+        "Gt",
+        "GtE",
+        "In",
+        "NotIn",
+        "Is",
+        "IsNot",
+        "Name",
+        "Load",
+        "Tuple",
+        "List",
+        "Constant",
+        "Num",  # ^ Python 3.8之前的常量节点
+        "Str",
+        "NameConstant",
+    )
+    if hasattr(ast, name)
+)
+
+
+def _bdd_compile_filter(expression: Union[str, None]):
+    """
+    编译属性过滤表达式,表达式为python语法,例如 "timeofday == 'night' and weather == 'rainy'",
+    只允许比较,布尔运算,变量名和常量
+
+    Args:
+        expression: 过滤表达式,为空时不过滤
+
+    Returns:
+        编译后的表达式(为空时返回None)
+    """
+    if not expression:
+        return None
+    tree = ast.parse(expression, "<bdd filter>", "eval")
+    for node in ast.walk(tree):
+        if not isinstance(node, _BDD_FILTER_NODES):
+            raise ValueError(
+                "unsupported syntax %s in filter: %s"
+                % (type(node).__name__, expression)
+            )
+    return compile(tree, "<bdd filter>", "eval")
+
+
+def _bdd_match(code, namespace: dict) -> bool:
+    """
+    判断变量空间是否满足编译后的过滤表达式
+    """
+    if code is None:
+        return True
+    return bool(eval(code, {"__builtins__": {}}, _BDDFilterNamespace(namespace)))
+
+
+def _bdd_frame_match(code, datum: dict) -> bool:
+    """
+    判断一帧是否满足编译后的帧过滤表达式,表达式可使用帧的attributes(weather,scene,timeofday)和name
+    """
+    if code is None:
+        return True
+    return _bdd_match(code, dict(datum.get("attributes") or {}, name=datum["name"]))
+
+
+def _bdd_frame_process(
+    datum: dict, width: int, height: int, frame_code=None, label_code=None
+) -> Union[list, None]:
+    """
+    处理一帧中所有的box2d标签,每个标签只调用一次bdd100k_labels_process和坐标转换
+
+    帧过滤表达式可使用帧的attributes(weather,scene,timeofday)和name,
+    标签过滤表达式可使用标签的attributes(occluded,truncated,trafficLightColor),原始category和box像素面积area,
+    过滤在坐标转换与字符串格式化之前完成
+
+    Args:
+        datum: 一帧图像对应的标签字典
+        width: 图像的宽度
+        height: 图像的高度
+        frame_code: 编译后的帧过滤表达式
+        label_code: 编译后的标签过滤表达式
+
+    Returns:
+        records(list): [(处理后的类别名称, 'x_center y_center w h'字段), ...], 帧不满足过滤条件时返回None
+    """
+    if not _bdd_frame_match(frame_code, datum):
+        return None
+    records = []
+    for label in datum["labels"]:
+        box2d = label.get("box2d")  # 存在box2d
+        if box2d:
+            if label_code is not None and not _bdd_match(
+                label_code,
+                dict(
+                    label.get("attributes") or {},
+                    category=label["category"],
+                    area=abs(box2d["x2"] - box2d["x1"])
+                    * abs(box2d["y2"] - box2d["y1"]),
+                ),
+            ):
+                continue
+            label = bdd100k_labels_process(label)  #! 这里会根据需求改变
+            x1 = float(round(box2d["x1"]) / width)
+            y1 = float(round(box2d["y1"]) / height)
+            x2 = float(round(box2d["x2"]) / width)
+            y2 = float(round(box2d["y2"]) / height)
+            x_center = (x1 + x2) / 2
+            y_center = (y1 + y2) / 2
+            w = max(x1, x2) - min(x1, x2)
+            h = max(y1, y2) - min(y1, y2)
+            # ^ 默认转变的位数是6位
+            records.append(
+                (
+                    label,
+                    " ".join(
+                        (
+                            "%.6f" % x_center,
+                            "%.6f" % y_center,
+                            "%.6f" % w,
+                            "%.6f" % h,
+                        )
+                    ),
+                )
+            )
+    return records
+
+
+class BDDSink:
+    """
+    BDD单次遍历转换的输出端基类,每一帧处理后的标签会依次分发到所有注册的输出端
+    """
+
+    def begin(self, trainval: str) -> None:
+        """开始处理train或val数据集"""
+
+    def __call__(self, datum: dict, records: list) -> None:
+        """处理一帧的标签,records为_bdd_frame_process的输出"""
+
+    def end(self, trainval: str) -> None:
+        """train或val数据集处理结束"""
+
+    def close(self) -> None:
+        """所有数据集处理结束"""
+
+
+class BDDCategoryCountSink(BDDSink):
+    """
+    类别数量统计,输出各数据集的类别个数和bdd100k.names文件(与get_bdd_categorys的输出一致)
+    """
+
+    def __init__(self, output_path: str):
+        self.output_path = output_path
+        self.all_categorys = []  # 训练集验证集所有类别(按照首次出现的顺序)
+        self.categorys = {}
+
+    def begin(self, trainval: str) -> None:
+        self.categorys = {}
+
+    def __call__(self, datum: dict, records: list) -> None:
+        for label, _ in records:
+            if label not in self.categorys.keys():
+                self.categorys[label] = 0
+                if label not in self.all_categorys:
+                    self.all_categorys.append(label)
+            self.categorys[label] += 1
+
+    def end(self, trainval: str) -> None:
+        with open(
+            self.output_path + os.sep + trainval + "_categorys_count.txt", "w"
+        ) as f:
+            keys = list(self.categorys.keys())
+            keys.sort()
+            for key in keys:
+                f.write(key + " : " + str(self.categorys[key]) + "\n")
+
+    def close(self) -> None:
+        logging.info(
+            "writing bdd100k.names file to %s"
+            % os.path.join(self.output_path, "bdd100k.names")
+        )
+        with open(os.path.join(self.output_path, "bdd100k.names"), "w") as f:
+            for category in self.all_categorys:
+                f.write(category + "\n")
+
+
+class BDDYoloSink(BDDSink):
+    """
+    输出全类别的YOLO格式标签(与bdd_to_yolo的输出一致)
+    """
+
+    def __init__(self, yolo_label_path: str, categorys: Union[list, None] = None):
+        """
+        Args:
+            yolo_label_path: 输出yolo格式的标签目录
+            categorys: 包含的数据类别,为None时按照类别首次出现的顺序分配ID(与get_bdd_categorys得到的顺序一致)
+        """
+        self.yolo_label_path = yolo_label_path
+        self.fixed = categorys is not None
+        self.categorys_dict = {}  # 类别映射字典
+        for i, category in enumerate(categorys or []):
+            self.categorys_dict.update({category: i})
+        self.yolo_path = None
+
+    def begin(self, trainval: str) -> None:
+        self.yolo_path = os.path.join(self.yolo_label_path, trainval)
+        os.makedirs(self.yolo_path, exist_ok=True)
+
+    def __call__(self, datum: dict, records: list) -> None:
+        file_str = ""  # 保存每个文件所需的字段
+        for label, xywh in records:
+            if not self.fixed and label not in self.categorys_dict:
+                self.categorys_dict[label] = len(self.categorys_dict)
+            file_str = file_str + str(self.categorys_dict[label]) + " " + xywh + "\n"
+        yolo_filename = os.path.splitext(datum["name"])[0] + ".txt"
+        with open(os.path.join(self.yolo_path, yolo_filename), "w") as f:
+            f.write(file_str)
+
+
+class BDDTrafficLightSink(BDDSink):
+    """
+    单独提取交通灯的YOLO格式标签并复制对应的图像(与bdd_traffic_light_to_yolo的输出一致)
+    """
+
+    def __init__(self, yolo_style_output_path: str, bdd_image_input_path: str):
+        """
+        Args:
+            yolo_style_output_path: 输出交通灯所对应的yolo格式的标签目录, 包含对应的图像和标签
+            bdd_image_input_path: 原始BDD数据集输入图像路径
+        """
+        self.yolo_style_output_path = yolo_style_output_path
+        self.bdd_image_input_path = bdd_image_input_path
+        self.traffic_ligth_dict = {}
+        for i, category in enumerate(TRAFFIC_LIGHT):
+            self.traffic_ligth_dict.update({category: i})
+
+    def begin(self, trainval: str) -> None:
+        self.trainval = trainval
+        self.traffic_light_path = os.path.join(self.yolo_style_output_path, trainval)
+        os.makedirs(self.traffic_light_path, exist_ok=True)
+        self.traffic_light_label_path = os.path.join(self.traffic_light_path, "labels")
+        os.makedirs(self.traffic_light_label_path, exist_ok=True)
+        self.traffic_light_image_path = os.path.join(self.traffic_light_path, "images")
+        os.makedirs(self.traffic_light_image_path, exist_ok=True)
+
+    def __call__(self, datum: dict, records: list) -> None:
+        file_str = ""  # 保存每个文件所需的字段
+        has_traffic_light = False  # 当前帧是否拥有交通灯
+        for label, xywh in records:
+            if label not in TRAFFIC_LIGHT:  # 不是交通灯就继续
+                continue
+            has_traffic_light = True
+            file_str = (
+                file_str + str(self.traffic_ligth_dict[label]) + " " + xywh + "\n"
+            )
+        if has_traffic_light:
+            traffic_light_yolo_filename = os.path.splitext(datum["name"])[0] + ".txt"
+            with open(
+                os.path.join(
+                    self.traffic_light_label_path, traffic_light_yolo_filename
+                ),
+                "w",
+            ) as f:
+                f.write(file_str)
+            original_image_name = os.path.join(
+                os.path.join(self.bdd_image_input_path, self.trainval), datum["name"]
+            )
+            output_image_name = os.path.join(
+                self.traffic_light_image_path, datum["name"]
+            )
+            shutil.copy(original_image_name, output_image_name)  # ^ 复制图片
+
+    def end(self, trainval: str) -> None:
+        logging.info("Writing %s category and id to .names files" % trainval)
+        with open(self.traffic_light_path + os.sep + "traffic_light.names", "w") as f:
+            for i, category in enumerate(TRAFFIC_LIGHT):
+                f.write(category + " : " + str(i) + "\n")
+
+
+def bdd_single_pass(
+    bdd_label_path: str,
+    sinks: list,
+    width: int = 1280,
+    height: int = 720,
+    stream: bool = False,
+    frame_filter: Union[str, None] = None,
+    label_filter: Union[str, None] = None,
+    workers: int = 1,
+    chunk_size: int = 1000,
+) -> None:
+    """
+    单次遍历BDD数据集的train和val标签,每一帧只解析和处理一次,并将结果分发给所有注册的输出端
+
+    Args:
+        bdd_label_path: bdd标签位置,该目录下应该有bdd100k_labels_images_train.json与bdd100k_labels_images_val.json文件
+        sinks: BDDSink输出端列表,例如BDDCategoryCountSink,BDDYoloSink,BDDTrafficLightSink
+        width: 图像的宽度
+        height: 图像的高度
+        stream: 是否增量解析json文件(大文件时降低内存占用)
+        frame_filter: 帧属性过滤表达式(weather,scene,timeofday),例如 "timeofday == 'night' and weather == 'rainy'"
+        label_filter: 标签属性过滤表达式(occluded,truncated,trafficLightColor,category,area),例如 "not occluded and area > 100"
+        workers: 进程数,大于1时帧的标签处理按块分发到进程池中,输出端仍在当前进程中按照帧的顺序执行
+        chunk_size: 多进程时每个任务包含的帧数
+
+    Returns:
+        None
+    """
+    frame_code = _bdd_compile_filter(frame_filter)
+    label_code = _bdd_compile_filter(label_filter)
+    label_path = bdd_label_path + os.sep + "bdd100k_labels_images_%s.json"
+    pool = Pool(workers) if workers > 1 else None
+    try:
+        for trainval in ["val", "train"]:
+            json_path = label_path % trainval
+            for sink in sinks:
+                sink.begin(trainval)
+            logging.info("Reading %s json file" % trainval)
+            data = _bdd_json_load(json_path, stream)
+            if pool is None:
+                frames = (
+                    (
+                        datum,
+                        _bdd_frame_process(
+                            datum, width, height, frame_code, label_code
+                        ),
+                    )
+                    for datum in data
+                )
+            else:
+                frames = _bdd_pool_frames(
+                    pool,
+                    workers,
+                    data,
+                    chunk_size,
+                    (width, height, frame_filter, label_filter),
+                )
+
+            for datum, records in tqdm(
+                frames, desc="Processing %s dataset labels" % trainval, unit="files"
+            ):
+                if records is None:  # 不满足帧过滤条件
+                    continue
+                for sink in sinks:
+                    sink(datum, records)
+
+            for sink in sinks:
+                sink.end(trainval)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    for sink in sinks:
+        sink.close()
+
+
+def _bdd_chunks(data: Iterable[dict], chunk_size: int) -> Iterator[list]:
+    """
+    将帧序列按照chunk_size切分为若干块,便于多进程按块处理
+    """
+    data = iter(data)
+    chunk = list(islice(data, chunk_size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(data, chunk_size))
+
+
+def _bdd_bounded_imap(
+    pool: Pool, func, iterable: Iterable, workers: int
+) -> Iterator[tuple]:
+    """
+    将任务逐个提交到进程池,最多同时存在2 * workers个任务,按照提交顺序取回结果,
+    避免Pool.imap在后台线程中一次性读取整个生成器(增量解析时整个数据集都会被读入任务队列)
+
+    Args:
+        pool: 进程池
+        func: 任务函数
+        iterable: 任务参数序列
+        workers: 进程数
+
+    Returns:
+        (任务参数, 任务结果)(生成器)
+    """
+    pending = deque()
+    for args in iterable:
+        pending.append((args, pool.apply_async(func, (args,))))
+        if len(pending) >= 2 * workers:
+            args, result = pending.popleft()
+            yield args, result.get()
+    while pending:
+        args, result = pending.popleft()
+        yield args, result.get()
+
+
+def _bdd_records_chunk(args: tuple) -> list:
+    """
+    多进程中处理一块帧数据,返回每一帧_bdd_frame_process的输出
+    """
+    chunk, width, height, frame_filter, label_filter = args
+    frame_code = _bdd_compile_filter(frame_filter)
+    label_code = _bdd_compile_filter(label_filter)
+    return [
+        _bdd_frame_process(datum, width, height, frame_code, label_code)
+        for datum in chunk
+    ]
+
+
+def _bdd_pool_frames(
+    pool: Pool, workers: int, data: Iterable[dict], chunk_size: int, options: tuple
+) -> Iterator[tuple]:
+    """
+    在进程池中按块处理帧的标签,按照帧的顺序返回(帧标签字典, records)
+
+    Args:
+        pool: 进程池
+        workers: 进程数
+        data: 帧标签字典序列
+        chunk_size: 每个任务包含的帧数
+        options: (width, height, frame_filter, label_filter)
+
+    Returns:
+        (datum, records)(生成器)
+    """
+    tasks = ((chunk,) + options for chunk in _bdd_chunks(data, chunk_size))
+    for args, chunk_records in _bdd_bounded_imap(
+        pool, _bdd_records_chunk, tasks, workers
+    ):
+        yield from zip(args[0], chunk_records)
+
+
+def _bdd_yolo_chunk(args: tuple) -> int:
+    """
+    多进程中处理一块帧数据并直接写出对应的YOLO标签文件
+
+    Returns:
+        处理的帧数
+    """
+    (
+        chunk,
+        yolo_label_path,
+        trainval,
+        categorys,
+        width,
+        height,
+        frame_filter,
+        label_filter,
+    ) = args
+    frame_code = _bdd_compile_filter(frame_filter)
+    label_code = _bdd_compile_filter(label_filter)
+    sink = BDDYoloSink(yolo_label_path, categorys)
+    sink.begin(trainval)
+    for datum in chunk:
+        records = _bdd_frame_process(datum, width, height, frame_code, label_code)
+        if records is not None:
+            sink(datum, records)
+    return len(chunk)
+
+
 def bdd_to_yolo(
     bdd_label_path: str,
     yolo_label_path: str,
     categorys: list,
     width: int = 1280,
     height: int = 720,
+    stream: bool = False,
+    workers: int = 1,
+    chunk_size: int = 1000,
+    frame_filter: Union[str, None] = None,
+    label_filter: Union[str, None] = None,
 ) -> None:
     """
     将BDD数据集格式转换为YOLO格式,注意,这里的格式输出为x_center,y_center,w,h
@@ -33,58 +584,57 @@ def bdd_to_yolo(
         categorys: 包含的数据类别
         width: 图像的宽度
         height: 图像的高度
+        stream: 是否增量解析json文件(大文件时降低内存占用)
+        workers: 进程数,大于1时将帧序列按块分发到进程池中转换并由子进程写标签文件
+        chunk_size: 多进程时每个任务包含的帧数
+        frame_filter: 帧属性过滤表达式(weather,scene,timeofday),例如 "timeofday == 'night' and weather == 'rainy'"
+        label_filter: 标签属性过滤表达式(occluded,truncated,trafficLightColor,category,area),例如 "not occluded and area > 100"
 
     Returns:
         None
     """
-    label_path = bdd_label_path + os.sep + "bdd100k_labels_images_%s.json"
-    categorys_dict = {}  # 类别映射字典
-    for i, category in enumerate(categorys):
-        categorys_dict.update({category: i})
-
-    for trainval in ["val", "train"]:
-        json_path = label_path % trainval
-        yolo_path = os.path.join(yolo_label_path, trainval)
-        os.makedirs(yolo_path, exist_ok=True)
-        logging.info("Reading %s json file" % trainval)
-        with open(json_path) as f:
-            j = f.read()
-        data = json.loads(j)
-
-        for datum in tqdm(
-            data, desc="Writing %s yolo format file" % trainval, unit="files"
-        ):
-            file_str = ""  # 保存每个文件所需的字段
-            for label in datum["labels"]:
-                box2d = label.get("box2d")  # 存在box2d
-                if box2d:
-                    label = bdd100k_labels_process(label)  #! 这里会根据需求改变
-                    x1 = float(round(box2d["x1"]) / width)
-                    y1 = float(round(box2d["y1"]) / height)
-                    x2 = float(round(box2d["x2"]) / width)
-                    y2 = float(round(box2d["y2"]) / height)
-                    x_center = (x1 + x2) / 2
-                    y_center = (y1 + y2) / 2
-                    w = max(x1, x2) - min(x1, x2)
-                    h = max(y1, y2) - min(y1, y2)
-                    # ^ 默认转变的位数是6位
-                    file_str = (
-                        file_str
-                        + str(categorys_dict[label])
-                        + " "
-                        + " ".join(
-                            (
-                                "%.6f" % x_center,
-                                "%.6f" % y_center,
-                                "%.6f" % w,
-                                "%.6f" % h,
-                            )
-                        )
-                        + "\n"
-                    )
-            yolo_filename = os.path.splitext(datum["name"])[0] + ".txt"
-            with open(os.path.join(yolo_path, yolo_filename), "w") as f:
-                f.write(file_str)
+    if workers <= 1:
+        bdd_single_pass(
+            bdd_label_path,
+            [BDDYoloSink(yolo_label_path, categorys)],
+            width,
+            height,
+            stream,
+            frame_filter,
+            label_filter,
+        )
+    else:
+        # ^ 分发任务之前检查过滤表达式
+        _bdd_compile_filter(frame_filter)
+        _bdd_compile_filter(label_filter)
+        label_path = bdd_label_path + os.sep + "bdd100k_labels_images_%s.json"
+        with Pool(workers) as pool:
+            for trainval in ["val", "train"]:
+                os.makedirs(os.path.join(yolo_label_path, trainval), exist_ok=True)
+                logging.info("Reading %s json file" % trainval)
+                data = _bdd_json_load(label_path % trainval, stream)
+                pbar = tqdm(
+                    desc="Writing %s yolo format file with %d workers"
+                    % (trainval, workers),
+                    unit="files",
+                )
+                for _, n in _bdd_bounded_imap(
+                    pool,
+                    _bdd_yolo_chunk,
+                    zip(
+                        _bdd_chunks(data, chunk_size),
+                        repeat(yolo_label_path),
+                        repeat(trainval),
+                        repeat(categorys),
+                        repeat(width),
+                        repeat(height),
+                        repeat(frame_filter),
+                        repeat(label_filter),
+                    ),
+                    workers,
+                ):
+                    pbar.update(n)
+                pbar.close()
     logging.info("All Finish! ~~~///(^v^)\\\~~~ ,233~")
 
 
@@ -94,6 +644,9 @@ def bdd_traffic_light_to_yolo(
     bdd_image_input_path: str,
     width: int = 1280,
     height: int = 720,
+    stream: bool = False,
+    frame_filter: Union[str, None] = None,
+    label_filter: Union[str, None] = None,
 ) -> None:
     """
     单独将BDD数据集中的交通灯数据提取出来，这里包含复制所提取的原始图像到指定路径并生成对应的YOLO格式的标签
@@ -104,140 +657,309 @@ def bdd_traffic_light_to_yolo(
         bdd_image_input_path: 原始BDD数据集输入图像路径
         width: 图像的宽度
         height: 图像的高度
+        stream: 是否增量解析json文件(大文件时降低内存占用)
+        frame_filter: 帧属性过滤表达式(weather,scene,timeofday),例如 "timeofday == 'night' and weather == 'rainy'"
+        label_filter: 标签属性过滤表达式(occluded,truncated,trafficLightColor,category,area),例如 "not occluded and area > 100"
 
     Returns:
         None
     """
-    label_path = bdd_label_path + os.sep + "bdd100k_labels_images_%s.json"
-    traffic_ligth_dict = {}
-    for i, category in enumerate(TRAFFIC_LIGHT):
-        traffic_ligth_dict.update({category: i})
-
-    for trainval in ["val", "train"]:
-        json_path = label_path % trainval
-
-        traffic_light_path = os.path.join(yolo_style_output_path, trainval)
-        os.makedirs(traffic_light_path, exist_ok=True)
-        traffic_light_label_path = os.path.join(traffic_light_path, "labels")
-        os.makedirs(traffic_light_label_path, exist_ok=True)
-        traffic_light_image_path = os.path.join(traffic_light_path, "images")
-        os.makedirs(traffic_light_image_path, exist_ok=True)
-
-        logging.info("Reading %s json file" % trainval)
-        with open(json_path) as f:
-            j = f.read()
-        data = json.loads(j)
-
-        for datum in tqdm(
-            data,
-            desc="Writing %s yolo format file for traffic light" % trainval,
-            unit="files",
-        ):
-            file_str = ""  # 保存每个文件所需的字段
-            has_traffic_light = False  # 当前帧是否拥有交通灯
-            for label in datum["labels"]:
-                box2d = label.get("box2d")  # 存在box2d
-                if box2d:
-                    label = bdd100k_labels_process(label)  #! 这里会根据需求改变
-                    if label not in TRAFFIC_LIGHT:  # 不是交通灯就继续
-                        continue
-                    else:
-                        has_traffic_light = True
-                    x1 = float(round(box2d["x1"]) / width)
-                    y1 = float(round(box2d["y1"]) / height)
-                    x2 = float(round(box2d["x2"]) / width)
-                    y2 = float(round(box2d["y2"]) / height)
-                    x_center = (x1 + x2) / 2
-                    y_center = (y1 + y2) / 2
-                    w = max(x1, x2) - min(x1, x2)
-                    h = max(y1, y2) - min(y1, y2)
-                    # ^ 默认转变的位数是6位
-                    file_str = (
-                        file_str
-                        + str(traffic_ligth_dict[label])
-                        + " "
-                        + " ".join(
-                            (
-                                "%.6f" % x_center,
-                                "%.6f" % y_center,
-                                "%.6f" % w,
-                                "%.6f" % h,
-                            )
-                        )
-                        + "\n"
-                    )
-            if has_traffic_light:
-                traffic_light_yolo_filename = (
-                    os.path.splitext(datum["name"])[0] + ".txt"
-                )
-                with open(
-                    os.path.join(traffic_light_label_path, traffic_light_yolo_filename),
-                    "w",
-                ) as f:
-                    f.write(file_str)
-                original_image_name = os.path.join(
-                    os.path.join(bdd_image_input_path, trainval), datum["name"]
-                )
-                output_image_name = os.path.join(
-                    traffic_light_image_path, datum["name"]
-                )
-                shutil.copy(original_image_name, output_image_name)  # ^ 复制图片
-
-        logging.info("Writing %s category and id to .names files" % trainval)
-        with open(traffic_light_path + os.sep + "traffic_light.names", "w") as f:
-            for i, category in enumerate(TRAFFIC_LIGHT):
-                f.write(category + " : " + str(i) + "\n")
+    bdd_single_pass(
+        bdd_label_path,
+        [BDDTrafficLightSink(yolo_style_output_path, bdd_image_input_path)],
+        width,
+        height,
+        stream,
+        frame_filter,
+        label_filter,
+    )
     logging.info(
         "All Traffic Light Tasks are Finished! ~~~///(^v^)\\\~~~ ,233~ Please Check it!"
     )
 
 
-def get_bdd_categorys(bdd_label_path: str, output_path: str) -> None:
+def get_bdd_categorys(
+    bdd_label_path: str,
+    output_path: str,
+    stream: bool = False,
+    frame_filter: Union[str, None] = None,
+    label_filter: Union[str, None] = None,
+) -> None:
     """
     获取BDD数据集的整体类别与对应类别数量,并根据str名称进行排序输出具体类别和对应个数
 
     Args:
         bdd_label_path: BDD标签路径(该目录下应该有bdd100k_labels_images_train.json与bdd100k_labels_images_val.json文件)
         output_path: output输出路径
+        stream: 是否增量解析json文件(大文件时降低内存占用)
+        frame_filter: 帧属性过滤表达式(weather,scene,timeofday),例如 "timeofday == 'night' and weather == 'rainy'"
+        label_filter: 标签属性过滤表达式(occluded,truncated,trafficLightColor,category,area),例如 "not occluded and area > 100"
 
     Returns:
         categorys(list):排序后的类别
     """
-    label_path = bdd_label_path + os.sep + "bdd100k_labels_images_%s.json"
-    all_categorys = []  # 训练集验证集所有类别
-    for trainval in ["val", "train"]:
-        categorys = {}
-        json_path = label_path % trainval
-
-        with open(json_path) as f:
-            j = f.read()
-        data = json.loads(j)
-
-        for datum in tqdm(
-            data, desc="Counting %s dataset categories and number" % trainval
-        ):  # 每张图
-            for label in datum["labels"]:
-                if label.get("box2d"):  # 存在box2d
-                    label = bdd100k_labels_process(label)  #! 这里会根据需求改变
-                    if label not in categorys.keys():
-                        categorys[label] = 0
-                    categorys[label] += 1
-                    if label not in all_categorys:
-                        all_categorys.append(label)
-
-        with open(output_path + os.sep + trainval + "_categorys_count.txt", "w") as f:
-            keys = list(categorys.keys())
-            keys.sort()
-            for key in keys:
-                f.write(key + " : " + str(categorys[key]) + "\n")
+    count_sink = BDDCategoryCountSink(output_path)
+    bdd_single_pass(
+        bdd_label_path,
+        [count_sink],
+        stream=stream,
+        frame_filter=frame_filter,
+        label_filter=label_filter,
+    )
+    return count_sink.all_categorys
 
-    logging.info(
-        "writing bdd100k.names file to %s" % os.path.join(output_path, "bdd100k.names")
+
+BDD_LANE_BACKGROUND = 255  # 车道线背景(忽略)
+
+
+def _bdd_mask_labels() -> tuple:
+    """
+    导入Visualization中的BDD标签定义,仅在绘制poly2d掩码时需要,YOLO转换不依赖Visualization
+
+    Returns:
+        (drivables, lane_categories)
+    """
+    visualization = str(Path(__file__).resolve().parents[2].joinpath("Visualization"))
+    if visualization not in sys.path:
+        sys.path.append(visualization)
+    from BDD100K_label import drivables, lane_categories  # BDD标签定义
+
+    return drivables, lane_categories
+
+
+def _bdd_color_lut(table: list):
+    """
+    根据BDD100K_label中的标签定义构建trainId到颜色(BGR)的查找表
+    """
+    import numpy as np
+
+    lut = np.zeros((256, 3), dtype=np.uint8)
+    for label in table:
+        lut[label.trainId] = label.color[::-1]  # RGB -> BGR(cv2)
+    return lut
+
+
+def _bdd_poly2d_points(poly: dict, closed: bool, bezier_num: int = 10):
+    """
+    将BDD的poly2d顶点转换为折线点,types中连续的两个'C'表示三次贝塞尔曲线的控制点,
+    末尾的'CC'只有闭合的多边形才以第一个顶点作为曲线终点,单独或不完整的'C'按照直线连接
+
+    Args:
+        poly: poly2d中的单个多边形,包括vertices,types和closed
+        closed: 是否为闭合的多边形
+        bezier_num: 每段贝塞尔曲线的采样点个数
+
+    Returns:
+        points: (N, 2)的点坐标
+    """
+    import numpy as np
+
+    vertices = np.asarray(poly["vertices"], dtype=np.float64)
+    types = poly.get("types", "")
+    if "C" not in types:
+        return vertices
+    t = np.linspace(0, 1, bezier_num + 1)[1:, None]
+    bernstein = np.hstack(
+        (
+            (1 - t) ** 3,
+            3 * (1 - t) ** 2 * t,
+            3 * (1 - t) * t**2,
+            t**3,
+        )
+    )  # 三次贝塞尔曲线的系数矩阵
+    points = [vertices[:1]]
+    i = 1
+    n = len(vertices)
+    while i < n:
+        if types[i : i + 2] == "CC" and (i + 2 < n or (closed and i + 2 == n)):
+            # ^ p0(上一个点), c1, c2, p3
+            p3 = vertices[(i + 2) % n]
+            control = np.vstack((vertices[i - 1], vertices[i], vertices[i + 1], p3))
+            points.append(bernstein @ control)
+            i += 3
+        else:
+            points.append(vertices[i : i + 1])
+            i += 1
+    return np.vstack(points)
+
+
+def _bdd_frame_masks(
+    datum: dict,
+    width: int,
+    height: int,
+    lane_thickness: int,
+    drivable_train_ids: dict,
+    lane_train_ids: dict,
+) -> tuple:
+    """
+    将一帧的poly2d标签绘制为可行驶区域和车道线的trainId掩码
+
+    所有多边形的顶点在一次numpy运算中完成取整,之后按照标签顺序依次绘制(后绘制的覆盖先绘制的).
+    cv2.fillPoly一次填充多个多边形时使用奇偶规则,重叠部分会被挖空,因此可行驶区域仍然逐个填充;
+    折线没有这一问题,车道线按照顺序将连续的相同trainId和闭合属性的折线合并为一次cv2.polylines调用
+
+    Args:
+        datum: 一帧图像对应的标签字典
+        width: 图像的宽度
+        height: 图像的高度
+        lane_thickness: 车道线绘制的线宽
+        drivable_train_ids: {可行驶区域类别名称: trainId}
+        lane_train_ids: {车道线类别名称: trainId}
+
+    Returns:
+        (drivable_mask, lane_mask)
+    """
+    import cv2
+    import numpy as np
+
+    drivable_mask = np.full(
+        (height, width), drivable_train_ids["background"], dtype=np.uint8
+    )  # 可行驶区域背景
+    lane_mask = np.full((height, width), BDD_LANE_BACKGROUND, dtype=np.uint8)
+
+    polys = []  # (是否为可行驶区域, trainId, 是否闭合)
+    points = []
+    for label in datum["labels"]:
+        poly2d = label.get("poly2d")
+        if not poly2d:
+            continue
+        attributes = label.get("attributes") or {}
+        if label["category"] == "drivable area":
+            train_id = drivable_train_ids.get(attributes.get("areaType"))
+            drivable = True
+        elif label["category"] == "lane":
+            train_id = lane_train_ids.get(attributes.get("laneType"))
+            drivable = False
+        else:
+            continue
+        if train_id is None:
+            continue
+        for poly in poly2d:
+            closed = bool(poly.get("closed", drivable))
+            polys.append((drivable, train_id, closed))
+            points.append(_bdd_poly2d_points(poly, closed))
+    if not polys:
+        return drivable_mask, lane_mask
+
+    # 所有多边形的坐标一次性取整后再拆分
+    sizes = np.cumsum([len(p) for p in points])[:-1]
+    points = np.split(np.rint(np.vstack(points)).astype(np.int32), sizes)
+    lanes = []  # (trainId, 是否闭合, 点坐标)
+    for (drivable, train_id, closed), pts in zip(polys, points):
+        if drivable:
+            cv2.fillPoly(drivable_mask, [pts], int(train_id))
+        else:
+            lanes.append((train_id, closed, pts))
+    for (train_id, closed), group in groupby(lanes, key=lambda x: x[:2]):
+        cv2.polylines(
+            lane_mask, [x[2] for x in group], closed, int(train_id), lane_thickness
+        )
+    return drivable_mask, lane_mask
+
+
+def _bdd_mask_chunk(args: tuple) -> int:
+    """
+    多进程中处理一块帧数据并写出可行驶区域和车道线掩码
+
+    Returns:
+        处理的帧数
+    """
+    import cv2
+
+    (
+        chunk,
+        output_paths,
+        width,
+        height,
+        lane_thickness,
+        color,
+        frame_filter,
+    ) = args
+    frame_code = _bdd_compile_filter(frame_filter)
+    drivables, lane_categories = _bdd_mask_labels()
+    drivable_train_ids = {label.name: label.trainId for label in drivables}
+    lane_train_ids = {label.name: label.trainId for label in lane_categories}
+    drivable_lut = _bdd_color_lut(drivables)
+    lane_lut = _bdd_color_lut(lane_categories)
+    for datum in chunk:
+        if not _bdd_frame_match(frame_code, datum):
+            continue
+        drivable_mask, lane_mask = _bdd_frame_masks(
+            datum, width, height, lane_thickness, drivable_train_ids, lane_train_ids
+        )
+        mask_name = os.path.splitext(datum["name"])[0] + ".png"
+        cv2.imwrite(os.path.join(output_paths[0], mask_name), drivable_mask)
+        cv2.imwrite(os.path.join(output_paths[1], mask_name), lane_mask)
+        if color:
+            cv2.imwrite(
+                os.path.join(output_paths[2], mask_name), drivable_lut[drivable_mask]
+            )
+            cv2.imwrite(os.path.join(output_paths[3], mask_name), lane_lut[lane_mask])
+    return len(chunk)
+
+
+def bdd_poly2d_to_mask(
+    bdd_label_path: str,
+    mask_output_path: str,
+    width: int = 1280,
+    height: int = 720,
+    lane_thickness: int = 8,
+    color: bool = False,
+    stream: bool = False,
+    workers: int = NUM_THREADS,
+    chunk_size: int = 200,
+    frame_filter: Union[str, None] = None,
+) -> None:
+    """
+    将BDD数据集的poly2d标签绘制为可行驶区域和车道线类别的掩码图,掩码值为BDD100K_label中drivables和lane_categories的trainId
+
+    Args:
+        bdd_label_path: bdd标签位置,该目录下应该有bdd100k_labels_images_train.json与bdd100k_labels_images_val.json文件
+        mask_output_path: 掩码输出目录,其下包括drivable和lane目录(color为True时还包括drivable_color和lane_color)
+        width: 图像的宽度
+        height: 图像的高度
+        lane_thickness: 车道线绘制的线宽
+        color: 是否同时输出彩色的掩码图
+        stream: 是否增量解析json文件(大文件时降低内存占用)
+        workers: 进程数
+        chunk_size: 每个任务包含的帧数
+        frame_filter: 帧属性过滤表达式(weather,scene,timeofday)
+
+    Returns:
+        None
+    """
+    _bdd_compile_filter(frame_filter)  # ^ 分发任务之前检查过滤表达式
+    label_path = bdd_label_path + os.sep + "bdd100k_labels_images_%s.json"
+    mask_dirs = ["drivable", "lane"] + (
+        ["drivable_color", "lane_color"] if color else []
     )
-    with open(os.path.join(output_path, "bdd100k.names"), "w") as f:
-        for category in all_categorys:
-            f.write(category + "\n")
-    return all_categorys
+    with Pool(workers) as pool:
+        for trainval in ["val", "train"]:
+            output_paths = [
+                os.path.join(mask_output_path, x, trainval) for x in mask_dirs
+            ]
+            for x in output_paths:
+                os.makedirs(x, exist_ok=True)
+            logging.info("Reading %s json file" % trainval)
+            data = _bdd_json_load(label_path % trainval, stream)
+            pbar = tqdm(desc="Drawing %s poly2d masks" % trainval, unit="files")
+            for _, n in _bdd_bounded_imap(
+                pool,
+                _bdd_mask_chunk,
+                zip(
+                    _bdd_chunks(data, chunk_size),
+                    repeat(output_paths),
+                    repeat(width),
+                    repeat(height),
+                    repeat(lane_thickness),
+                    repeat(color),
+                    repeat(frame_filter),
+                ),
+                workers,
+            ):
+                pbar.update(n)
+            pbar.close()
+    logging.info("All BDD poly2d masks are finished! ~~~///(^v^)\\\~~~ ,233~")
 
 
 def bdd100k_labels_process(labels: dict) -> str:
@@ -336,17 +1058,111 @@ if __name__ == "__main__":
         help="BDD100K names file",
         metavar="bdd100k.names",
     )
+    parser.add_argument(
+        "-sp",
+        "--single_pass",
+        action="store_true",
+        help="count categories, write yolo labels (and traffic light subset) in one pass",
+    )
+    parser.add_argument(
+        "-t",
+        "--traffic_light",
+        action="store_true",
+        help="extract the traffic light subset in the single pass mode",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes for converting labels to yolo format",
+        metavar="workers",
+    )
+    parser.add_argument(
+        "-m",
+        "--mask_output_path",
+        type=str,
+        default=None,
+        help="draw BDD poly2d labels to drivable and lane masks in this path",
+        metavar="mask_output_path",
+    )
+    parser.add_argument(
+        "-ff",
+        "--frame_filter",
+        type=str,
+        default=None,
+        help="frame attribute filter, e.g. \"timeofday == 'night' and weather == 'rainy'\"",
+        metavar="frame_filter",
+    )
+    parser.add_argument(
+        "-lf",
+        "--label_filter",
+        type=str,
+        default=None,
+        help='label attribute filter, e.g. "not occluded and area > 100"',
+        metavar="label_filter",
+    )
+    parser.add_argument(
+        "-s",
+        "--stream",
+        action="store_true",
+        help="parse the BDD json file frame by frame to keep memory flat",
+    )
     opt = parser.parse_args()
 
     if not os.path.isdir(opt.label_path):
         raise Exception("label_path is not a dir!")
     if not os.path.exists(opt.output_label_path):
         os.mkdir(opt.output_label_path)
-    if not os.path.exists(opt.names_file):
-        logging.info("%s path file do not exist:" % opt.names_file)
-        categorys = get_bdd_categorys(opt.label_path, opt.output_class_path)
+    if opt.single_pass:  # ^ 单次遍历同时完成类别统计,YOLO标签和交通灯提取
+        sinks = []
+        if not os.path.exists(opt.names_file):
+            logging.info("%s path file do not exist:" % opt.names_file)
+            categorys = None  # 类别ID按照首次出现的顺序分配,与get_bdd_categorys一致
+            sinks.append(BDDCategoryCountSink(opt.output_class_path))
+        else:
+            categorys = get_bdd_categorys_from_file(opt.names_file)
+        sinks.append(BDDYoloSink(opt.output_label_path, categorys))
+        if opt.traffic_light:
+            sinks.append(
+                BDDTrafficLightSink(opt.output_label_path, opt.input_image_path)
+            )
+        bdd_single_pass(
+            opt.label_path,
+            sinks,
+            stream=opt.stream,
+            frame_filter=opt.frame_filter,
+            label_filter=opt.label_filter,
+            workers=opt.workers,
+        )
     else:
-        categorys = get_bdd_categorys_from_file(opt.names_file)
+        if not os.path.exists(opt.names_file):
+            logging.info("%s path file do not exist:" % opt.names_file)
+            categorys = get_bdd_categorys(
+                opt.label_path,
+                opt.output_class_path,
+                opt.stream,
+                opt.frame_filter,
+                opt.label_filter,
+            )
+        else:
+            categorys = get_bdd_categorys_from_file(opt.names_file)
 
-    bdd_to_yolo(opt.label_path, opt.output_label_path, categorys)
-    # bdd_traffic_light_to_yolo(opt.label_path, opt.output_label_path, opt.input_image_path) #^ 根据实际情况选择是否需要单独输出交通灯的内容
+        bdd_to_yolo(
+            opt.label_path,
+            opt.output_label_path,
+            categorys,
+            stream=opt.stream,
+            workers=opt.workers,
+            frame_filter=opt.frame_filter,
+            label_filter=opt.label_filter,
+        )
+        # bdd_traffic_light_to_yolo(opt.label_path, opt.output_label_path, opt.input_image_path, stream=opt.stream) #^ 根据实际情况选择是否需要单独输出交通灯的内容
+    if opt.mask_output_path:  # ^ 可行驶区域和车道线掩码
+        bdd_poly2d_to_mask(
+            opt.label_path,
+            opt.mask_output_path,
+            stream=opt.stream,
+            workers=opt.workers if opt.workers > 1 else NUM_THREADS,
+            frame_filter=opt.frame_filter,
+        )
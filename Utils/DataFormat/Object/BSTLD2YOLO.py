@@ -1,19 +1,51 @@
 # Bosch Small Traffic Lights Dataset 博世交通灯数据集转换为YOLO的xywh格式
 
+import os
 import yaml
 import shutil
 import logging
 import argparse
 from tqdm import tqdm
 from pathlib import Path
+from typing import Union
+from multiprocessing.pool import ThreadPool
 
+NUM_THREADS = min(8, os.cpu_count())  # number of copying threads
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)  # ^ 优先使用libyaml的C加速
 logging.basicConfig(format="%(levelname)s:%(message)s", level=logging.INFO)
 
 
+def load_BSTLD_labels(
+    input_path: str,
+    BSTLD_labels_path: list = ["train.yaml", "test.yaml", "additional_train.yaml"],
+) -> dict:
+    """
+    读取Bosch Small Traffic Lights Dataset的所有yaml标签文件,每个文件只解析一次,libyaml可用时使用C加速的解析器
+
+    Args:
+        input_path: BSTLD数据集对应的根目录(该目录下包括additional_train.yaml,train.yaml,test.yaml和rgb图像目录)
+        BSTLD_labels_path: BSTLD数据集对应的所有标签文件
+
+    Returns:
+        labels_dict: 标签文件名称与对应标签列表的字典
+    """
+    input_path = Path(input_path)
+    if YAML_LOADER is yaml.SafeLoader:
+        logging.warning("libyaml is not available, using the pure python yaml loader")
+    labels_dict = {}
+    for label_file in BSTLD_labels_path:
+        logging.info("Reading %s" % str(input_path.joinpath(label_file)))
+        with open(input_path.joinpath(label_file), "r", encoding="utf-8") as f:
+            labels_dict[label_file] = yaml.load(f, Loader=YAML_LOADER)
+        logging.info("Reading %s is finished" % str(input_path.joinpath(label_file)))
+    return labels_dict
+
+
 def get_BSTLD_categorys(
     input_path: str,
     output_path: str,
     BSTLD_labels_path: list = ["train.yaml", "test.yaml", "additional_train.yaml"],
+    labels_dict: Union[dict, None] = None,
 ) -> dict:
     """
     统计Bosch Small Traffic Lights Dataset数据集的标签类别，并根据名称进行排序输出具体类别和对应个数
@@ -22,30 +54,26 @@ def get_BSTLD_categorys(
         input_path: BSTLD数据集对应的根目录(该目录下包括additional_train.yaml,train.yaml,test.yaml和rgb图像目录)
         output_path: 输出图像和标签的位置
         BSTLD_labels_path: BSTLD数据集对应的所有标签文件
+        labels_dict: load_BSTLD_labels已经读取的标签,为None时重新读取
 
     Returns:
         keys: 输出统计类别名称和对应的ID
     """
-    input_path = Path(input_path)
     output_path = Path(output_path)
+    if labels_dict is None:
+        labels_dict = load_BSTLD_labels(input_path, BSTLD_labels_path)
     categorys_dict = {}  # ^ 类别获取和统计计数
     for label_file in BSTLD_labels_path:
-        logging.info("Reading %s" % str(input_path.joinpath(label_file)))
-        with open(input_path.joinpath(label_file), "r", encoding="utf-8") as f:
-            labels = yaml.load(f, Loader=yaml.FullLoader)
-            logging.info(
-                "Reading %s is finished" % str(input_path.joinpath(label_file))
-            )
-            for label in tqdm(
-                labels,
-                desc="Counting %s dataset categories and number" % label_file,
-                unit=" images",
-            ):
-                for current_label in label["boxes"]:
-                    if current_label["label"] not in categorys_dict.keys():
-                        categorys_dict.update({current_label["label"]: 1})  # 初始化类别
-                    else:
-                        categorys_dict[current_label["label"]] += 1  # 类别数据加1
+        for label in tqdm(
+            labels_dict[label_file],
+            desc="Counting %s dataset categories and number" % label_file,
+            unit=" images",
+        ):
+            for current_label in label["boxes"]:
+                if current_label["label"] not in categorys_dict.keys():
+                    categorys_dict.update({current_label["label"]: 1})  # 初始化类别
+                else:
+                    categorys_dict[current_label["label"]] += 1  # 类别数据加1
 
     logging.info(
         "Writing Bosch Small Traffic Lights Dataset number of categories to %s"
@@ -78,6 +106,8 @@ def BSTLD_to_yolo(
     width: int = 1280,
     height: int = 720,
     BSTLD_labels_path: list = ["train.yaml", "test.yaml", "additional_train.yaml"],
+    labels_dict: Union[dict, None] = None,
+    workers: int = NUM_THREADS,
 ) -> None:
     """
     将Bosch Small Traffic Lights Dataset的yaml格式数据转换为YOLOv5的xywh格式
@@ -89,6 +119,8 @@ def BSTLD_to_yolo(
         width: 图像的宽度
         height: 图像的高度
         BSTLD_labels_path: BSTLD数据集对应的所有标签文件
+        labels_dict: load_BSTLD_labels已经读取的标签,为None时重新读取
+        workers: 复制图像的线程数,图像复制与标签写入同时进行
 
     Returns:
         None
@@ -100,26 +132,26 @@ def BSTLD_to_yolo(
     image_output_path.mkdir(exist_ok=True, parents=True)  # ^ 构建路径
     label_output_path.mkdir(exist_ok=True, parents=True)
 
-    for label_file in BSTLD_labels_path:
+    if labels_dict is None:
+        labels_dict = load_BSTLD_labels(input_path, BSTLD_labels_path)
 
-        # 构建每个训练集类别的文件目录
-        current_file_image_output_path = image_output_path.joinpath(
-            Path(label_file).stem
-        )
-        current_file_label_output_path = label_output_path.joinpath(
-            Path(label_file).stem
-        )
-        current_file_image_output_path.mkdir(exist_ok=True, parents=True)
-        current_file_label_output_path.mkdir(exist_ok=True, parents=True)
+    # ^ 图像复制为IO操作,使用线程池与标签写入并行,出错时退出with终止线程池
+    with ThreadPool(workers) as copy_pool:
+        copy_results = []
+        for label_file in BSTLD_labels_path:
 
-        logging.info("Reading %s" % str(input_path.joinpath(label_file)))
-        with open(input_path.joinpath(label_file), "r", encoding="utf-8") as f:
-            labels = yaml.load(f, Loader=yaml.FullLoader)
-            logging.info(
-                "Reading %s is finished" % str(input_path.joinpath(label_file))
+            # 构建每个训练集类别的文件目录
+            current_file_image_output_path = image_output_path.joinpath(
+                Path(label_file).stem
+            )
+            current_file_label_output_path = label_output_path.joinpath(
+                Path(label_file).stem
             )
+            current_file_image_output_path.mkdir(exist_ok=True, parents=True)
+            current_file_label_output_path.mkdir(exist_ok=True, parents=True)
+
             for label in tqdm(
-                labels,
+                labels_dict[label_file],
                 desc="Changing %s's BSTLD format to yolo format and Copying the images which have trffic light"
                 % label_file,
                 unit=" images",
@@ -158,7 +190,9 @@ def BSTLD_to_yolo(
                             .joinpath(Path(label["path"]).name)
                         )  #! 需要特别注意的是,test.yaml的路径格式和其他两个不一样,给的是url地址,所以这里需要根据实际的情况进行转换
                     else:
-                        image_path = input_path.joinpath(label["path"])  # ^ 当前对应图像的绝对路径
+                        image_path = input_path.joinpath(
+                            label["path"]
+                        )  # ^ 当前对应图像的绝对路径
 
                     with open(
                         current_file_label_output_path.joinpath(
@@ -168,12 +202,25 @@ def BSTLD_to_yolo(
                         encoding="utf-8",
                     ) as f:
                         f.write(label_str)
-                    shutil.copy(
-                        image_path,
-                        current_file_image_output_path.joinpath(image_path.name),
+                    copy_results.append(
+                        copy_pool.apply_async(
+                            shutil.copy,
+                            (
+                                image_path,
+                                current_file_image_output_path.joinpath(
+                                    image_path.name
+                                ),
+                            ),
+                        )
                     )  # ^ 复制图片
 
-        logging.info("Process %s is finished" % str(input_path.joinpath(label_file)))
+            logging.info(
+                "Process %s is finished" % str(input_path.joinpath(label_file))
+            )
+
+        logging.info("Waiting for the image copying")
+        for result in tqdm(copy_results, desc="Copying images", unit=" images"):
+            result.get()  # ^ 抛出复制过程中的异常
 
 
 if __name__ == "__main__":
@@ -209,5 +256,8 @@ if __name__ == "__main__":
     )
     opt = parser.parse_args()
 
-    keys_dict = get_BSTLD_categorys(opt.input_path, opt.output_path)  # ^ 统计标签信息
-    BSTLD_to_yolo(opt.input_path, opt.output_path, keys_dict)
+    labels_dict = load_BSTLD_labels(opt.input_path)  # ^ 每个标签文件只解析一次
+    keys_dict = get_BSTLD_categorys(
+        opt.input_path, opt.output_path, labels_dict=labels_dict
+    )  # ^ 统计标签信息
+    BSTLD_to_yolo(opt.input_path, opt.output_path, keys_dict, labels_dict=labels_dict)
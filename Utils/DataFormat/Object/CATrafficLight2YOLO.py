@@ -4,10 +4,17 @@
 import json
 import logging
 import argparse
+import numpy as np
 from tqdm import tqdm
 from typing import Union
 from pathlib import Path
-import xml.etree.ElementTree as ET
+from itertools import islice
+from collections import deque
+from multiprocessing.pool import Pool
+from voc_reader import NUM_THREADS, read_voc_batch
+from labelme_reader import read_labelme_batch
+from label_schema import LabelSchema, load_label_dicts
+from label_ledger import LabelLedger
 
 logging.basicConfig(format="%(levelname)s:%(message)s", level=logging.INFO)
 
@@ -361,43 +368,198 @@ TRAFFIC_LIGHT_ORIGIN = {
 }
 
 
-def _statistics_lables(count_output_file: str, traffic_light_count: dict) -> None:
+# 统计时合并为同一类别的TrainID #^ 这里根据实际情况修改
+TRAFFIC_LIGHT_BUCKETS = {
+    0: "red_number_none",
+    1: "green_number_none",
+    2: "yellow_number_none",
+}
+
+
+def traffic_light_schema(schema_file: Union[str, None] = None) -> LabelSchema:
     """
-    该函数用于提取统计各个统计标签的信息
+    编译交通灯的标签定义,TrainID为0,1,2的标签分别合并统计为红,绿,黄色数字,其余标签按照TRAFFIC_LIGHT_DICT中的名称统计,不在其中的计入other
+
+    Args:
+        schema_file: 外部YAML定义文件,包含TRAFFIC_LIGHT_ORIGIN与TRAFFIC_LIGHT_DICT(可选),为None时使用本文件中的定义
+
+    Returns:
+        LabelSchema
+    """
+    label_origin, label_dict = TRAFFIC_LIGHT_ORIGIN, TRAFFIC_LIGHT_DICT
+    if schema_file is not None:
+        label_dicts = load_label_dicts(schema_file)
+        label_origin = label_dicts["TRAFFIC_LIGHT_ORIGIN"]
+        label_dict = label_dicts.get("TRAFFIC_LIGHT_DICT", label_dict)
+    return LabelSchema(label_origin, list(label_dict.keys()), TRAFFIC_LIGHT_BUCKETS)
+
+
+TRAFFIC_LIGHT_SCHEMA = traffic_light_schema()
+
+
+def _statistics_lables(
+    count_output_file: str,
+    traffic_light_count: dict,
+    tool: str = "",
+    source: str = "",
+    replace_counts: bool = False,
+) -> None:
+    """
+    该函数用于提取统计各个统计标签的信息,数量记录在统计文件名加.db后缀的账本(SQLite)中,多个转换可以同时写入,
+    统计文件由账本中的总数导出,格式与原先一致.与原先一样,统计文件存在时新的数量累加到其中,统计文件不存在时从零开始
 
     Args:
         count_output_file: 统计文件的绝对路径
         traffic_light_count: 统计的交通灯各类类别个数
+        tool: 转换函数名称
+        source: 转换的输入文件或目录
+        replace_counts: 是否替换同一转换函数对同一输入之前记录的数量,而不是累加
 
     Returns:
         None
     """
     count_output_file = Path(count_output_file)
-    if count_output_file.exists():
-        logging.warn(
-            f"The {str(count_output_file)} exists, the new count number will be added to it!"
+    source = str(Path(source).resolve())  # ^ 相对路径与绝对路径视为同一输入
+    with LabelLedger(
+        count_output_file.with_name(count_output_file.name + ".db")
+    ) as ledger:
+        ledger.import_text(count_output_file)
+        if count_output_file.exists():
+            if replace_counts:
+                logging.warning(
+                    f"The {str(count_output_file)} exists, the previous count number of {source} will be replaced!"
+                )
+            else:
+                logging.warning(
+                    f"The {str(count_output_file)} exists, the new count number will be added to it!"
+                )
+        ledger.record(
+            traffic_light_count,
+            tool,
+            source,
+            count_output_file,
+            list(traffic_light_count.keys()),
+            replace=replace_counts,
+            reset_if_missing=True,
         )
-        with open(count_output_file, "r", encoding="utf-8") as f:
-            for x in f.readlines():
-                label, count = x.split(":", 1)
-                count = int(count)
-                traffic_light_count[label] += count
 
-    with open(count_output_file, "w", encoding="utf-8") as f:
-        for key in traffic_light_count.keys():
-            f.write(key + ":" + str(traffic_light_count[key]) + "\n")
+
+def _baidu_line_to_yolo(oneline: str, schema: LabelSchema, indices: list) -> tuple:
+    """
+    解析百度标注导出文件中的一行,得到YOLO格式的标签文本并记录标签索引
+
+    Args:
+        oneline: 标注文件中的一行
+        schema: 编译后的标签定义
+        indices: 标签索引列表(原地追加),用于类别统计
+
+    Returns:
+        (标签文件名称, YOLO格式标签文本),非标签行返回None
+    """
+    if not oneline.startswith("http"):
+        return None
+    url_path, _, label_json = oneline.split(
+        maxsplit=2
+    )  # 百度标注的路径, 文件名称, 标签信息
+    label_json = json.loads(label_json)
+    url_path = Path(url_path)
+    elements = label_json["result"][0]["elements"]
+    width = label_json["result"][0]["size"]["width"]
+    height = label_json["result"][0]["size"]["height"]
+    object_str = ""
+    for label in elements:
+        if label["markType"] != "rect":  # 确保标注的是矩形框
+            continue
+        for label_name in label[
+            "attribute"
+        ].values():  # 这里的属性值标注存在很多,名称只是其中之一
+            index = schema.index.get(label_name)
+            if index is None:
+                continue
+            indices.append(index)
+            train_id = schema.train_id(index)  #! 通过原始定义获取TrainId
+            if train_id != -1:
+                w = label["width"] / width
+                h = label["height"] / height
+                x_central = label["posX"] / width + w / 2
+                y_central = label["posY"] / height + h / 2
+                object_str = (
+                    object_str
+                    + str(train_id)
+                    + " "
+                    + " ".join(
+                        (
+                            "%.6f" % x_central,
+                            "%.6f" % y_central,
+                            "%.6f" % w,
+                            "%.6f" % h,
+                        )
+                    )
+                    + "\n"
+                )  # ^ YOLOv5格式
+    return url_path.stem, object_str
+
+
+def _baidu_chunk_to_yolo(lines: list, schema: LabelSchema) -> tuple:
+    """
+    多进程解析一批标注行
+
+    Args:
+        lines: 标注文件中连续的若干行
+        schema: 编译后的标签定义
+
+    Returns:
+        (results, counts): results为按行顺序的[(标签文件名称, YOLO格式标签文本)],counts为该批次各统计类别的数量
+    """
+    indices = []
+    results = []
+    for oneline in lines:
+        result = _baidu_line_to_yolo(oneline, schema, indices)
+        if result is not None:
+            results.append(result)
+    return results, schema.bincount(indices)
+
+
+def _read_line_chunks(lable_file: Path, chunk_size: int):
+    """
+    流式读取文本文件,每次返回chunk_size行,避免readlines读取整个文件
+
+    Args:
+        lable_file: 文本文件路径
+        chunk_size: 每一批的行数
+
+    Returns:
+        lines(生成器)
+    """
+    with open(lable_file, "r", encoding="utf-8") as f:
+        while True:
+            lines = list(islice(f, chunk_size))
+            if not lines:
+                return
+            yield lines
 
 
 def CA_BAIDU_traffic_light_to_YOLO(
-    lable_file: str, output_path: str, count_output_file: str
+    lable_file: str,
+    output_path: str,
+    count_output_file: str,
+    workers: int = NUM_THREADS,
+    chunk_size: int = 1000,
+    schema_file: Union[str, None] = None,
+    replace_counts: bool = False,
 ) -> None:
     """
     该函数用于提取CA标注的交通灯的标签信息,注意,这里的格式输出为x_center,y_center,w,h
+    标注文件按照chunk_size行分批流式读取并多进程解析,按照文件中的顺序写出标签,内存占用只与chunk_size有关
 
     Args:
         lable_file: 标注的文档路径
         output_path: yolo格式输出的路径
         count_output_file: 输出的模型数据量统计
+        workers: 解析标注的进程数,小于等于1时在当前进程中解析
+        chunk_size: 每一批解析的行数
+        schema_file: 外部YAML标签定义文件,为None时使用本文件中的定义
+        replace_counts: 是否替换之前对同一输入记录的类别数量,默认累加到统计文件
 
     Returns:
         None
@@ -406,77 +568,47 @@ def CA_BAIDU_traffic_light_to_YOLO(
     output_path = Path(output_path)
     output_path.mkdir(exist_ok=True, parents=True)
 
+    schema = traffic_light_schema(schema_file) if schema_file else TRAFFIC_LIGHT_SCHEMA
     # 类别统计
-    traffic_light_count = {}
-    for key in TRAFFIC_LIGHT_DICT.keys():
-        traffic_light_count[key] = 0
-    traffic_light_count["other"] = 0
+    counts = np.zeros(len(schema.count_names), dtype=np.int64)
+
+    def write_chunk(chunk_result: tuple) -> None:
+        results, chunk_counts = chunk_result
+        np.add(counts, chunk_counts, out=counts)
+        # 写YOLOv5标签
+        for stem, object_str in results:
+            with open(output_path.joinpath(stem + ".txt"), "w", encoding="utf-8") as f:
+                f.write(object_str)
 
     logging.info("Writing YOLO format labels")
-    with open(lable_file, "r", encoding="utf-8") as f:
-        for oneline in f.readlines():
-            if oneline.startswith("http"):
-                url_path, _, label_json = oneline.split(
-                    maxsplit=2
-                )  # 百度标注的路径, 文件名称, 标签信息
-                label_json = json.loads(label_json)
-                url_path = Path(url_path)
-                elements = label_json["result"][0]["elements"]
-                width = label_json["result"][0]["size"]["width"]
-                height = label_json["result"][0]["size"]["height"]
-                object_str = ""
-                for label in elements:
-                    for label_name in label[
-                        "attribute"
-                    ].values():  # 这里的属性值标注存在很多,名称只是其中之一
-                        if (
-                            label_name in TRAFFIC_LIGHT_ORIGIN.keys()
-                            and label["markType"] == "rect"
-                        ):  # 确保标注的是矩形框
-                            train_id = TRAFFIC_LIGHT_ORIGIN[label_name][
-                                "train_id"
-                            ]  #! 通过原始定义获取TrainId
-                            # 标签名称转换和数量统计 #^ 这里根据实际情况修改
-                            if train_id == 0:
-                                traffic_light_count["red_number_none"] += 1
-                            elif train_id == 1:
-                                traffic_light_count["green_number_none"] += 1
-                            elif train_id == 2:
-                                traffic_light_count["yellow_number_none"] += 1
-                            else:
-                                try:
-                                    traffic_light_count[label_name] += 1
-                                except:
-                                    traffic_light_count["other"] += 1
-
-                            if train_id != -1:
-                                w = label["width"] / width
-                                h = label["height"] / height
-                                x_central = label["posX"] / width + w / 2
-                                y_central = label["posY"] / height + h / 2
-                                object_str = (
-                                    object_str
-                                    + str(train_id)
-                                    + " "
-                                    + " ".join(
-                                        (
-                                            "%.6f" % x_central,
-                                            "%.6f" % y_central,
-                                            "%.6f" % w,
-                                            "%.6f" % h,
-                                        )
-                                    )
-                                    + "\n"
-                                )  # ^ YOLOv5格式
-                # 写YOLOv5标签
-                with open(
-                    output_path.joinpath(url_path.stem + ".txt"), "w", encoding="utf-8"
-                ) as f:
-                    f.write(object_str)
+    chunks = _read_line_chunks(lable_file, chunk_size)
+    if workers <= 1:
+        for chunk in tqdm(
+            chunks, desc="Changing CA BAIDU format to YOLO format!", unit="chunks"
+        ):
+            write_chunk(_baidu_chunk_to_yolo(chunk, schema))
+    else:
+        with Pool(workers) as pool:
+            # ^ 最多同时存在2 * workers个批次,按照提交顺序取回结果,保证写出顺序与文件一致
+            pending = deque()
+            for chunk in tqdm(
+                chunks, desc="Changing CA BAIDU format to YOLO format!", unit="chunks"
+            ):
+                pending.append(pool.apply_async(_baidu_chunk_to_yolo, (chunk, schema)))
+                if len(pending) >= 2 * workers:
+                    write_chunk(pending.popleft().get())
+            while pending:
+                write_chunk(pending.popleft().get())
 
     # 统计数量输出
     logging.info("Outputing the number statistics!")
-    _statistics_lables(count_output_file, traffic_light_count)
+    _statistics_lables(
+        count_output_file,
+        schema.count_dict(counts),
+        "CA_BAIDU_traffic_light_to_YOLO",
+        lable_file,
+        replace_counts,
+    )
     logging.info("All Finish! (*╹▽╹*), HaHa~")
 
 
@@ -487,6 +619,9 @@ def CA_Labelimg_VOC_to_YOLO(
     width: Union[int, None] = None,
     height: Union[int, None] = None,
     save_difficult: bool = False,
+    workers: int = NUM_THREADS,
+    schema_file: Union[str, None] = None,
+    replace_counts: bool = False,
 ) -> None:
     """
     将VOC的xml格式数据转换为YOLOv5的xywh格式
@@ -498,6 +633,9 @@ def CA_Labelimg_VOC_to_YOLO(
         width: 自行设置的覆盖内部XML宽高的宽
         height: 自行设置的覆盖内部XML宽高的高
         save_difficult: 是否保留难样例
+        workers: 读取xml的进程数
+        schema_file: 外部YAML标签定义文件,为None时使用本文件中的定义
+        replace_counts: 是否替换之前对同一输入记录的类别数量,默认累加到统计文件
 
     Returns:
         None
@@ -505,63 +643,31 @@ def CA_Labelimg_VOC_to_YOLO(
     input_path = Path(input_path)
     output_path = Path(output_path)
     output_path.mkdir(exist_ok=True, parents=True)
-    # 类别统计
-    traffic_light_count = {}
-    for key in TRAFFIC_LIGHT_DICT.keys():
-        traffic_light_count[key] = 0
-    traffic_light_count["other"] = 0
+    schema = traffic_light_schema(schema_file) if schema_file else TRAFFIC_LIGHT_SCHEMA
+    indices = []  # 类别统计
 
     logging.info("Getting the xml labels")
     images_path = list(input_path.glob("*.xml"))
-    for label_file in tqdm(
-        images_path, desc="Changing CA Labelimg VOC format to YOLO format!", unit="xmls"
+    for label_file, (w, h, objects) in read_voc_batch(
+        images_path,
+        width,
+        height,
+        workers,
+        desc="Changing CA Labelimg VOC format to YOLO format!",
     ):
         with open(
             output_path.joinpath(label_file.stem + ".txt"), "w", encoding="utf-8"
         ) as out_file:
-            tree = ET.parse(label_file)
-            root = tree.getroot()
-            size = root.find("size")
-            w = int(size.find("width").text)  # 宽
-            h = int(size.find("height").text)  # 高
-            if width:  # 长宽覆盖
-                w = width
-            if height:
-                h = height
-            for obj in root.iter("object"):
-                difficult = obj.find("difficult").text
-                label_name = obj.find("name").text
-
-                if save_difficult:  # 是否过滤难样例
-                    if label_name not in TRAFFIC_LIGHT_ORIGIN.keys():
-                        continue
-                else:
-                    if label_name not in TRAFFIC_LIGHT_ORIGIN or int(difficult) == 1:
-                        continue
-
-                train_id = TRAFFIC_LIGHT_ORIGIN[label_name]["train_id"]
-
-                # 标签名称转换和数量统计 #^ 这里根据实际情况修改
-                if train_id == 0:
-                    traffic_light_count["red_number_none"] += 1
-                elif train_id == 1:
-                    traffic_light_count["green_number_none"] += 1
-                elif train_id == 2:
-                    traffic_light_count["yellow_number_none"] += 1
-                else:
-                    try:
-                        traffic_light_count[label_name] += 1
-                    except:
-                        traffic_light_count["other"] += 1
-
+            for label_name, difficult, box in objects:
+                index = schema.index.get(label_name)
+                if index is None or (
+                    not save_difficult and difficult == 1
+                ):  # 是否过滤难样例
+                    continue
+
+                indices.append(index)
+                train_id = schema.train_id(index)
                 if train_id != -1:
-                    bndbox = obj.find("bndbox")
-                    box = [
-                        float(bndbox.find("xmin").text),
-                        float(bndbox.find("ymin").text),
-                        float(bndbox.find("xmax").text),
-                        float(bndbox.find("ymax").text),
-                    ]
                     x_cnetral = (box[0] + box[2]) / (2 * w)
                     y_central = (box[1] + box[3]) / (2 * h)
                     w_ = (box[2] - box[0]) / w
@@ -576,12 +682,23 @@ def CA_Labelimg_VOC_to_YOLO(
 
     # 统计数量输出
     logging.info("Outputing the number statistics!")
-    _statistics_lables(count_output_file, traffic_light_count)
+    _statistics_lables(
+        count_output_file,
+        schema.count_dict(schema.bincount(indices)),
+        "CA_Labelimg_VOC_to_YOLO",
+        input_path,
+        replace_counts,
+    )
     logging.info("All Finish! (*╹▽╹*), HaHa~")
 
 
 def CA_Labelme_Json_to_YOLO(
-    input_path: str, output_path: str, count_output_file: str
+    input_path: str,
+    output_path: str,
+    count_output_file: str,
+    workers: int = NUM_THREADS,
+    schema_file: Union[str, None] = None,
+    replace_counts: bool = False,
 ) -> None:
     """
     将百度标注的单独的Json格式转换为YOLO格式
@@ -590,6 +707,9 @@ def CA_Labelme_Json_to_YOLO(
         input_path: 输入json格式文件标签的路径
         output_path: 输出txt标签的路径
         count_output_file: 输出的模型数据量统计
+        workers: 读取json的进程数
+        schema_file: 外部YAML标签定义文件,为None时使用本文件中的定义
+        replace_counts: 是否替换之前对同一输入记录的类别数量,默认累加到统计文件
 
     Returns:
         None
@@ -598,41 +718,20 @@ def CA_Labelme_Json_to_YOLO(
     output_path = Path(output_path)
     output_path.mkdir(exist_ok=True, parents=True)
 
-    # 类别统计
-    traffic_light_count = {}
-    for key in TRAFFIC_LIGHT_DICT.keys():
-        traffic_light_count[key] = 0
-    traffic_light_count["other"] = 0
+    schema = traffic_light_schema(schema_file) if schema_file else TRAFFIC_LIGHT_SCHEMA
+    indices = []  # 类别统计
 
     logging.info("Getting the json labels")
     images_path = list(input_path.glob("*.json"))
 
-    for label_file in tqdm(
-        images_path,
-        desc="Changing CA Labelme json format to YOLO format!",
-        unit="jsons",
+    for label_file, (width, height, shapes) in read_labelme_batch(
+        images_path, workers, desc="Changing CA Labelme json format to YOLO format!"
     ):
-        with open(label_file, "r", encoding="utf-8") as f:
-            json_str = json.load(f)
-        width = json_str["imageWidth"]
-        height = json_str["imageHeight"]
         label_str = ""
-        for x in json_str["shapes"]:
-            label_name = x["label"]
-            train_id = TRAFFIC_LIGHT_ORIGIN[label_name]["train_id"]
-            # 标签名称转换和数量统计 #^ 这里根据实际情况修改
-            if train_id == 0:
-                traffic_light_count["red_number_none"] += 1
-            elif train_id == 1:
-                traffic_light_count["green_number_none"] += 1
-            elif train_id == 2:
-                traffic_light_count["yellow_number_none"] += 1
-            else:
-                try:
-                    traffic_light_count[label_name] += 1
-                except:
-                    traffic_light_count["other"] += 1
-
+        for x in shapes:
+            index = schema.index[x["label"]]
+            indices.append(index)
+            train_id = schema.train_id(index)
             if train_id != -1:
                 x_cnetral = (x["points"][0][0] + x["points"][1][0]) / (2 * width)
                 y_central = (x["points"][0][1] + x["points"][1][1]) / (2 * height)
@@ -653,7 +752,13 @@ def CA_Labelme_Json_to_YOLO(
 
     # 统计数量输出
     logging.info("Outputing the number statistics!")
-    _statistics_lables(count_output_file, traffic_light_count)
+    _statistics_lables(
+        count_output_file,
+        schema.count_dict(schema.bincount(indices)),
+        "CA_Labelme_Json_to_YOLO",
+        input_path,
+        replace_counts,
+    )
     logging.info("All Finish! (*╹▽╹*), HaHa~")
 
 
@@ -687,10 +792,24 @@ if __name__ == "__main__":
         help="The output name to save quantity statistics infomation",
         metavar="CA_count_output_path",
     )
+    parser.add_argument(
+        "-s",
+        "--schema_file",
+        type=str,
+        default=None,
+        help="The YAML file of TRAFFIC_LIGHT_ORIGIN/TRAFFIC_LIGHT_DICT label definition, use the definition in this file if not set",
+        metavar="schema_file",
+    )
+    parser.add_argument(
+        "-rc",
+        "--replace_counts",
+        action="store_true",
+        help="replace the counts recorded for the same input in the statistics file instead of adding to them",
+    )
     opt = parser.parse_args()
 
-    # CA_BAIDU_traffic_light_to_YOLO(opt.lable_file, opt.output_path, opt.count_output_file)
+    # CA_BAIDU_traffic_light_to_YOLO(opt.lable_file, opt.output_path, opt.count_output_file, schema_file=opt.schema_file, replace_counts=opt.replace_counts)
 
-    # CA_Labelimg_VOC_to_YOLO(opt.lable_file, opt.output_path, opt.count_output_file, 1920, 1080) #^ 此处的长宽根据实际情况自行调整
+    # CA_Labelimg_VOC_to_YOLO(opt.lable_file, opt.output_path, opt.count_output_file, 1920, 1080, schema_file=opt.schema_file, replace_counts=opt.replace_counts) #^ 此处的长宽根据实际情况自行调整
 
-    # CA_Labelme_Json_to_YOLO(opt.lable_file, opt.output_path, opt.count_output_file)
+    # CA_Labelme_Json_to_YOLO(opt.lable_file, opt.output_path, opt.count_output_file, schema_file=opt.schema_file, replace_counts=opt.replace_counts)
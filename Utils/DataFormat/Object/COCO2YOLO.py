@@ -1,12 +1,18 @@
 # COCO数据集转换为YOLO的xywh格式
 
+import os
+import json
 import shutil
 import logging
 import argparse
+import numpy as np
 from tqdm import tqdm
+from array import array
 from pathlib import Path
-from pycocotools.coco import COCO
+from typing import Iterator, Union
+from multiprocessing.pool import Pool
 
+NUM_THREADS = min(8, os.cpu_count())  # number of multiprocessing threads
 logging.basicConfig(format="%(levelname)s:%(message)s", level=logging.INFO)
 
 # COCO_CLASS = ['person','bicycle','car','motorcycle','airplane','bus',
@@ -26,7 +32,453 @@ logging.basicConfig(format="%(levelname)s:%(message)s", level=logging.INFO)
 COCO_CLASS = ["traffic light"]  # ^ 仅采样交通灯
 
 
-def coco_to_yolo(coco_image_path: str, coco_label_path: str, output_path: str) -> None:
+class _JsonChunkReader:
+    """
+    按块读取json文件的增量解析器,只在缓存中保留当前正在解析的值
+    """
+
+    def __init__(self, f, chunk_size: int = 1 << 20):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        """读取下一块数据,文件结束时返回False"""
+        chunk = self.f.read(self.chunk_size)
+        self.eof = not chunk
+        self.buf = self.buf[self.pos :] + chunk
+        self.pos = 0
+        return not self.eof
+
+    def peek(self) -> str:
+        """跳过空白并返回下一个字符"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of json file")
+
+    def next(self) -> str:
+        """返回并跳过下一个非空白字符"""
+        c = self.peek()
+        self.pos += 1
+        return c
+
+    def value(self):
+        """解析下一个完整的json值"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                if end < len(self.buf) or self.eof:  # 数字等值可能被块边界截断
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            self._fill()
+
+
+def _coco_json_stream(json_path: Union[str, Path], keys: tuple) -> Iterator[tuple]:
+    """
+    增量解析COCO标签json文件,逐个返回keys中顶层数组的元素,其他顶层字段直接跳过
+
+    Args:
+        json_path: COCO标签json文件路径
+        keys: 需要读取的顶层数组名称,例如("images", "annotations", "categories")
+
+    Returns:
+        (顶层数组名称, 数组元素)(生成器)
+    """
+    with open(json_path, "r", encoding="utf-8") as f:
+        reader = _JsonChunkReader(f)
+        if reader.next() != "{":
+            raise ValueError("%s is not a COCO json file" % str(json_path))
+        while True:
+            c = reader.peek()
+            if c == "}":
+                return
+            if c == ",":
+                reader.next()
+                continue
+            key = reader.value()
+            if reader.next() != ":":
+                raise ValueError("%s is not a valid json file" % str(json_path))
+            if key in keys and reader.peek() == "[":
+                reader.next()
+                while True:
+                    c = reader.peek()
+                    if c == "]":
+                        reader.next()
+                        break
+                    if c == ",":
+                        reader.next()
+                        continue
+                    yield key, reader.value()
+            else:
+                reader.value()  # 其他字段(info,licenses等)直接丢弃
+
+
+class COCOLite:
+    """
+    不依赖pycocotools的轻量COCO标注读取,仅保留bbox,category_id,image_id,iscrowd与图像的宽高和文件名,
+    数据保存在NumPy数组中,按图像分组通过排序索引完成
+    """
+
+    def __init__(self, annotation_file: Union[str, Path]):
+        img_ids, widths, heights = array("q"), array("d"), array("d")
+        ann_img_ids, ann_cat_ids, iscrowd = array("q"), array("q"), array("b")
+        bboxes = array("d")
+        self.file_names = []
+        self.cats = {}  # ^ 类别ID与类别名称
+        for key, item in _coco_json_stream(
+            annotation_file, ("images", "annotations", "categories")
+        ):
+            if key == "annotations":
+                ann_img_ids.append(item["image_id"])
+                ann_cat_ids.append(item["category_id"])
+                iscrowd.append(item.get("iscrowd", 0))
+                bboxes.extend(item["bbox"])
+            elif key == "images":
+                img_ids.append(item["id"])
+                widths.append(item["width"])
+                heights.append(item["height"])
+                self.file_names.append(item["file_name"])
+            else:
+                self.cats[item["id"]] = item["name"]
+
+        self.img_ids = np.frombuffer(img_ids, dtype=np.int64)
+        self.widths = np.frombuffer(widths, dtype=np.float64)
+        self.heights = np.frombuffer(heights, dtype=np.float64)
+        self.ann_img_ids = np.frombuffer(ann_img_ids, dtype=np.int64)
+        self.ann_cat_ids = np.frombuffer(ann_cat_ids, dtype=np.int64)
+        self.iscrowd = np.frombuffer(iscrowd, dtype=np.int8)
+        self.bboxes = np.frombuffer(bboxes, dtype=np.float64).reshape(-1, 4)
+
+        # 标注对应的图像行号
+        img_order = np.argsort(self.img_ids, kind="stable")
+        pos = np.searchsorted(self.img_ids, self.ann_img_ids, sorter=img_order)
+        pos = np.minimum(pos, max(len(img_order) - 1, 0))
+        matched = (
+            self.img_ids[img_order][pos] == self.ann_img_ids
+            if len(img_order)
+            else np.zeros(len(self.ann_img_ids), dtype=bool)
+        )
+        if not matched.all():  # ^ image_id不在images中的标注直接丢弃
+            logging.warning(
+                "%d annotations refer to image ids not in images, skipped"
+                % np.count_nonzero(~matched)
+            )
+            self.ann_img_ids = self.ann_img_ids[matched]
+            self.ann_cat_ids = self.ann_cat_ids[matched]
+            self.iscrowd = self.iscrowd[matched]
+            self.bboxes = self.bboxes[matched]
+            pos = pos[matched]
+        self.ann_img_index = img_order[pos]
+
+    def getCatIds(self, catNms: Union[str, list]) -> list:
+        """根据类别名称获取类别ID(与pycocotools接口一致)"""
+        catNms = catNms if isinstance(catNms, list) else [catNms]
+        return [i for i, name in self.cats.items() if name in catNms]
+
+    def group_by_image(self, ann_index: np.ndarray, sort_key: np.ndarray) -> Iterator:
+        """
+        将标注按照图像分组,同一图像内按照sort_key排序(相同时保持原始顺序)
+
+        Args:
+            ann_index: 需要分组的标注索引
+            sort_key: 与ann_index对应的图像内排序键
+
+        Returns:
+            (图像行号, 该图像的标注索引)(生成器)
+        """
+        img_index = self.ann_img_index[ann_index]
+        order = np.lexsort((sort_key, img_index))  # ^ 稳定排序
+        ann_index = ann_index[order]
+        img_index = img_index[order]
+        starts = np.flatnonzero(np.diff(img_index)) + 1
+        for idx in np.split(np.arange(len(ann_index)), starts):
+            if len(idx):
+                yield img_index[idx[0]], ann_index[idx]
+
+
+def _coco_lite_to_yolo(
+    coco_label_path: Path,
+    categorys_dict: dict,
+    coco_image_path: Path,
+    image_output_path: Path,
+    label_output_path: Path,
+) -> dict:
+    """
+    基于COCOLite的COCO转换,按图像分组后以NumPy整体计算坐标,每个标签文件只写一次,每张图像只复制一次
+
+    Returns:
+        category_number: 各个类别的标注个数
+    """
+    coco = COCOLite(coco_label_path)
+    category_index = np.full(max(coco.cats, default=0) + 1, -1, dtype=np.int64)
+    for category, i in categorys_dict.items():
+        category_index[coco.getCatIds(category)] = i  # ^ COCO类别ID与YOLO类别ID的对应
+
+    ann_class = np.full(len(coco.ann_cat_ids), -1, dtype=np.int64)
+    valid = (coco.ann_cat_ids >= 0) & (coco.ann_cat_ids < len(category_index))
+    ann_class[valid] = category_index[coco.ann_cat_ids[valid]]
+    ann_index = np.flatnonzero(ann_class >= 0)
+    category_count = np.bincount(ann_class[ann_index], minlength=len(categorys_dict))
+
+    # 所有标注的xywh一次性计算
+    bboxes = coco.bboxes
+    widths = coco.widths[coco.ann_img_index]
+    heights = coco.heights[coco.ann_img_index]
+    xywh = np.stack(
+        (
+            (bboxes[:, 0] + bboxes[:, 2] / 2) / widths,
+            (bboxes[:, 1] + bboxes[:, 3] / 2) / heights,
+            bboxes[:, 2] / widths,
+            bboxes[:, 3] / heights,
+        ),
+        axis=1,
+    )
+
+    groups = coco.group_by_image(ann_index, ann_class[ann_index])
+    for img_index, anns in tqdm(
+        groups, desc="Coping images and Writing labels", unit="images"
+    ):
+        file_name = coco.file_names[img_index]
+        lines = [
+            "%d %.6f %.6f %.6f %.6f\n" % (c, *box)
+            for c, box in zip(ann_class[anns].tolist(), xywh[anns].tolist())
+        ]
+        with open(label_output_path.joinpath(Path(file_name).stem + ".txt"), "w") as f:
+            f.write("".join(lines))
+        shutil.copy(
+            coco_image_path.joinpath(file_name), image_output_path.joinpath(file_name)
+        )
+
+    return {category: str(category_count[i]) for category, i in categorys_dict.items()}
+
+
+def _merge_multi_segment(segments: list) -> np.ndarray:
+    """
+    将多段多边形在相邻两段的最近点处连接为一个多边形(与YOLOv5 JSON2YOLO的merge_multi_segment相同的思路),
+    正向依次走过每一段的一侧,到达最后一段后反向走回另一侧,连接线来回各走一次,面积为零,不会包含各段之间的背景
+
+    Args:
+        segments: 每一段多边形的像素坐标(一维或(N, 2))
+
+    Returns:
+        合并后的多边形(N, 2)
+    """
+    segments = [np.asarray(x, dtype=np.float64).reshape(-1, 2) for x in segments]
+    if len(segments) == 1:
+        return segments[0]
+    links = []  # 相邻两段的最近点索引(前一段的出口, 后一段的入口)
+    for a, b in zip(segments[:-1], segments[1:]):
+        distance = ((a[:, None, :] - b[None, :, :]) ** 2).sum(-1)
+        links.append(np.unravel_index(np.argmin(distance), distance.shape))
+    forward, backward = [], []
+    for i, segment in enumerate(segments):
+        entry_index = links[i - 1][1] if i > 0 else None
+        exit_index = links[i][0] if i < len(links) else None
+        if entry_index is None or exit_index is None:  # 首尾两段完整走一圈后回到连接点
+            ring = np.roll(
+                segment, -(exit_index if entry_index is None else entry_index), axis=0
+            )
+            forward.append(np.vstack((ring, ring[:1])))
+        else:  # 中间的段正向走入口到出口的一侧,反向走另一侧
+            ring = np.roll(segment, -entry_index, axis=0)
+            k = (exit_index - entry_index) % len(segment)
+            forward.append(ring[: k + 1])
+            backward.append(np.vstack((ring[k:], ring[:1])))
+    return np.vstack(forward + backward[::-1])
+
+
+def _coco_rle_to_polygon(args: tuple) -> tuple:
+    """
+    多进程中将iscrowd的RLE标注解码为掩码,并提取外轮廓作为YOLO-seg的多边形,多个轮廓在最近点处连接为一个多边形
+
+    Returns:
+        (标注ID, 多边形的像素坐标(一维),轮廓不存在时为None)
+    """
+    import cv2
+    from pycocotools import mask as mask_utils
+
+    ann_id, segmentation, height, width = args
+    if isinstance(segmentation["counts"], list):  # ^ 未压缩的RLE
+        segmentation = mask_utils.frPyObjects(segmentation, height, width)
+    mask = mask_utils.decode(segmentation)
+    contours = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+    contours = [x.reshape(-1, 2) for x in contours if len(x) > 2]
+    if not contours:
+        return ann_id, None
+    return ann_id, _merge_multi_segment(contours).reshape(-1)
+
+
+def _coco_image_polygons(anns: list, img: dict, crowd_polygons: dict) -> list:
+    """
+    将一张图像所有标注的多边形坐标一次性归一化,多段多边形在最近点处连接为一个多边形
+
+    Args:
+        anns: [(YOLO类别ID, 标注), ...]
+        img: 图像信息
+        crowd_polygons: iscrowd标注ID与RLE解码得到的多边形的对应
+
+    Returns:
+        lines: YOLO-seg格式的每一行
+    """
+    parts, classes = [], []
+    for i, ann in anns:
+        if ann.get("iscrowd", 0):
+            polygon = crowd_polygons.get(ann["id"])
+        else:
+            polygon = [x for x in ann["segmentation"] if len(x) >= 6]
+            polygon = _merge_multi_segment(polygon).reshape(-1) if polygon else None
+        if polygon is None:
+            continue
+        parts.append(polygon)
+        classes.append(i)
+    if not parts:
+        return []
+
+    # 一张图像的所有坐标一次性归一化
+    coords = np.concatenate(parts).astype(np.float64).reshape(-1, 2)
+    coords = np.clip(coords / (img["width"], img["height"]), 0, 1).reshape(-1)
+    sizes = np.cumsum([len(x) for x in parts])[:-1]
+    return [
+        str(i) + " " + " ".join("%.6f" % x for x in polygon.tolist()) + "\n"
+        for i, polygon in zip(classes, np.split(coords, sizes))
+    ]
+
+
+def _coco_to_yolo_image_major(
+    coco: "COCO",
+    categorys_dict: dict,
+    coco_image_path: Path,
+    image_output_path: Path,
+    label_output_path: Path,
+    seg_output_path: Union[Path, None] = None,
+) -> dict:
+    """
+    以图像为主序的COCO转换,所有标注只遍历一次并按图像分组,每个标签文件只写一次,每张图像只复制一次
+
+    Args:
+        coco: 初始化后的COCO类
+        categorys_dict: 需要提取的类别名称与YOLO类别ID的对应字典
+        coco_image_path: COCO数据集对应的图像所在的位置
+        image_output_path: 图像输出的位置
+        label_output_path: 标签输出的位置
+        seg_output_path: YOLO-seg多边形标签输出的位置,为None时不输出
+
+    Returns:
+        category_number: 各个类别的标注个数
+    """
+    category_index = {}  # ^ COCO类别ID与YOLO类别ID的对应
+    for category, i in categorys_dict.items():
+        for category_id in coco.getCatIds(category):
+            category_index[category_id] = i
+
+    category_count = [0] * len(categorys_dict)
+    image_anns = {}  # ^ 图像ID与对应标注的分组
+    for ann in coco.dataset["annotations"]:
+        i = category_index.get(ann["category_id"])
+        if i is None:
+            continue
+        category_count[i] += 1
+        image_anns.setdefault(ann["image_id"], []).append((i, ann))
+
+    crowd_polygons = {}  # ^ iscrowd标注ID与RLE解码得到的多边形
+    if seg_output_path is not None:
+        crowd_anns = [
+            (
+                ann["id"],
+                ann["segmentation"],
+                coco.imgs[img_id]["height"],
+                coco.imgs[img_id]["width"],
+            )
+            for img_id, anns in image_anns.items()
+            for _, ann in anns
+            if ann.get("iscrowd", 0)
+        ]
+        with Pool(NUM_THREADS) as pool:
+            for ann_id, polygon in tqdm(
+                pool.imap_unordered(_coco_rle_to_polygon, crowd_anns, chunksize=16),
+                desc="Decoding iscrowd RLE masks to polygons",
+                total=len(crowd_anns),
+                unit="anns",
+            ):
+                crowd_polygons[ann_id] = polygon
+
+    for img_id, anns in tqdm(
+        image_anns.items(), desc="Coping images and Writing labels", unit="images"
+    ):
+        img = coco.imgs[img_id]
+        anns.sort(key=lambda x: x[0])  # ^ 与按类别处理时的行顺序保持一致
+        lines = []
+        for i, ann in anns:
+            x_center = (ann["bbox"][0] + ann["bbox"][2] / 2) / img["width"]
+            y_center = (ann["bbox"][1] + ann["bbox"][3] / 2) / img["height"]
+            w = ann["bbox"][2] / img["width"]
+            h = ann["bbox"][3] / img["height"]
+            lines.append(
+                str(i)
+                + " "
+                + " ".join(
+                    ("%.6f" % x_center, "%.6f" % y_center, "%.6f" % w, "%.6f" % h)
+                )
+                + "\n"
+            )
+        yolo_output_label_name = label_output_path.joinpath(
+            Path(img["file_name"]).stem + ".txt"
+        )
+        with open(yolo_output_label_name, "w") as f:
+            f.write("".join(lines))
+        if seg_output_path is not None:  # ^ YOLO-seg多边形标签
+            with open(
+                seg_output_path.joinpath(Path(img["file_name"]).stem + ".txt"), "w"
+            ) as f:
+                f.write("".join(_coco_image_polygons(anns, img, crowd_polygons)))
+        shutil.copy(
+            coco_image_path.joinpath(img["file_name"]),
+            image_output_path.joinpath(img["file_name"]),
+        )
+
+    return {category: str(category_count[i]) for category, i in categorys_dict.items()}
+
+
+def _load_coco(coco_label_path: Path, usage: str):
+    """
+    使用pycocotools初始化COCO类(lite模式以外的转换需要),未安装pycocotools时给出明确的错误
+
+    Args:
+        coco_label_path: COCO数据集对应的标签所在的位置
+        usage: 需要pycocotools的功能描述,用于错误信息
+
+    Returns:
+        初始化后的COCO类
+    """
+    try:
+        from pycocotools.coco import COCO
+    except ImportError:
+        raise ImportError(
+            "pycocotools is required for %s, install it or use the lite mode" % usage
+        ) from None
+    logging.info("Initializing COCO Class from %s" % str(coco_label_path))
+    return COCO(coco_label_path)  # 初始化COCO类
+
+
+def coco_to_yolo(
+    coco_image_path: str,
+    coco_label_path: str,
+    output_path: str,
+    image_major: bool = False,
+    lite: bool = False,
+    segment: bool = False,
+) -> None:
     """
     将COCO的json格式数据转换为YOLOv5的xywh格式
 
@@ -34,6 +486,9 @@ def coco_to_yolo(coco_image_path: str, coco_label_path: str, output_path: str) -
         coco_image_path: COCO数据集对应的图像所在的位置(训练接和验证集图像应该和标签相互对应)
         coco_label_path: COCO数据集对应的标签所在的位置(训练接和验证集图像应该和标签相互对应)
         output_path: 输出图像和标签的位置
+        image_major: 是否按照图像为主序处理,每个标签文件只写一次,每张图像只复制一次(类别较多时效率更高)
+        lite: 是否使用不依赖pycocotools的COCOLite增量读取标注(启动更快,内存更小,按图像为主序处理)
+        segment: 是否同时输出YOLO-seg多边形标签(保存在labels_seg目录,需要pycocotools,按图像为主序处理)
 
     Returns:
         None
@@ -46,54 +501,91 @@ def coco_to_yolo(coco_image_path: str, coco_label_path: str, output_path: str) -
     image_output_path.mkdir(exist_ok=True, parents=True)
     label_output_path.mkdir(exist_ok=True, parents=True)
 
-    logging.info("Initializing COCO Class from %s" % str(coco_label_path))
-    coco = COCO(coco_label_path)  # 初始化COCO类
     categorys_dict = {}
     for i, category in enumerate(COCO_CLASS):
         categorys_dict.update({category: i})
 
-    category_number = {}  # ^ 用于记录各个类别的个数
-    for category in tqdm(
-        COCO_CLASS, desc="Coping images and Writing labels", unit="category"
-    ):
-        # logging.info('Writing Class ---%s--- to yolo format' % category)
-        category_id = coco.getCatIds(category)
-        category_number.update(
-            {category: str(len(coco.getAnnIds(catIds=category_id)))}
-        )  # ^ 类别个数统计
-        img_ids = coco.getImgIds(catIds=category_id)
-        imgs = coco.loadImgs(img_ids)
-        for img in imgs:
-            file_str = ""  # ^ 保存当前类别字段
-            annIds = coco.getAnnIds(
-                imgIds=img["id"], catIds=category_id, iscrowd=None
-            )  # ^ iscrowd属性根据实际情况自行选择
-            anns = coco.loadAnns(annIds)
-            for ann in anns:
-                x_center = (ann["bbox"][0] + ann["bbox"][2] / 2) / img["width"]
-                y_center = (ann["bbox"][1] + ann["bbox"][3] / 2) / img["height"]
-                w = ann["bbox"][2] / img["width"]
-                h = ann["bbox"][3] / img["height"]
-                file_str = (
-                    file_str
-                    + str(categorys_dict[category])
-                    + " "
-                    + " ".join(
-                        ("%.6f" % x_center, "%.6f" % y_center, "%.6f" % w, "%.6f" % h)
+    if segment:
+        if lite:
+            logging.warning("lite mode has no segmentation, using pycocotools instead")
+        seg_output_path = output_path.joinpath("labels_seg")
+        seg_output_path.mkdir(exist_ok=True, parents=True)
+        coco = _load_coco(coco_label_path, "the segment mode")
+        category_number = _coco_to_yolo_image_major(
+            coco,
+            categorys_dict,
+            coco_image_path,
+            image_output_path,
+            label_output_path,
+            seg_output_path,
+        )
+    elif lite:
+        logging.info("Streaming COCO annotations from %s" % str(coco_label_path))
+        category_number = _coco_lite_to_yolo(
+            coco_label_path,
+            categorys_dict,
+            coco_image_path,
+            image_output_path,
+            label_output_path,
+        )
+    elif image_major:
+        coco = _load_coco(coco_label_path, "the image major mode")
+        category_number = _coco_to_yolo_image_major(
+            coco, categorys_dict, coco_image_path, image_output_path, label_output_path
+        )
+    else:
+        coco = _load_coco(coco_label_path, "the default mode")
+        category_number = {}  # ^ 用于记录各个类别的个数
+        for category in tqdm(
+            COCO_CLASS, desc="Coping images and Writing labels", unit="category"
+        ):
+            # logging.info('Writing Class ---%s--- to yolo format' % category)
+            category_id = coco.getCatIds(category)
+            category_number.update(
+                {category: str(len(coco.getAnnIds(catIds=category_id)))}
+            )  # ^ 类别个数统计
+            img_ids = coco.getImgIds(catIds=category_id)
+            imgs = coco.loadImgs(img_ids)
+            for img in imgs:
+                file_str = ""  # ^ 保存当前类别字段
+                annIds = coco.getAnnIds(
+                    imgIds=img["id"], catIds=category_id, iscrowd=None
+                )  # ^ iscrowd属性根据实际情况自行选择
+                anns = coco.loadAnns(annIds)
+                for ann in anns:
+                    x_center = (ann["bbox"][0] + ann["bbox"][2] / 2) / img["width"]
+                    y_center = (ann["bbox"][1] + ann["bbox"][3] / 2) / img["height"]
+                    w = ann["bbox"][2] / img["width"]
+                    h = ann["bbox"][3] / img["height"]
+                    file_str = (
+                        file_str
+                        + str(categorys_dict[category])
+                        + " "
+                        + " ".join(
+                            (
+                                "%.6f" % x_center,
+                                "%.6f" % y_center,
+                                "%.6f" % w,
+                                "%.6f" % h,
+                            )
+                        )
+                        + "\n"
                     )
-                    + "\n"
+                yolo_output_label_name = label_output_path.joinpath(
+                    Path(img["file_name"]).stem + ".txt"
                 )
-            yolo_output_label_name = label_output_path.joinpath(
-                Path(img["file_name"]).stem + ".txt"
-            )
-            # 追加写标签
-            with open(yolo_output_label_name, "a") as f:
-                f.write(file_str)
-            # 复制图片
-            input_image_path = Path(coco_image_path).joinpath(Path(img["file_name"]))
-            ouput_image_path = Path(image_output_path).joinpath(Path(img["file_name"]))
-            if not ouput_image_path.exists():
-                shutil.copy(input_image_path, ouput_image_path)
+                # 追加写标签
+                with open(yolo_output_label_name, "a") as f:
+                    f.write(file_str)
+                # 复制图片
+                input_image_path = Path(coco_image_path).joinpath(
+                    Path(img["file_name"])
+                )
+                ouput_image_path = Path(image_output_path).joinpath(
+                    Path(img["file_name"])
+                )
+                if not ouput_image_path.exists():
+                    shutil.copy(input_image_path, ouput_image_path)
 
     logging.info("Writing category number to file")
     with open(output_path.joinpath("category_number.txt"), "w") as f:
@@ -141,6 +633,31 @@ if __name__ == "__main__":
         help="the file output path of COCO format to yolov5 format!",
         metavar="coco_output_path",
     )
+    parser.add_argument(
+        "-m",
+        "--image_major",
+        action="store_true",
+        help="group annotations by image and write every label file once",
+    )
+    parser.add_argument(
+        "-lite",
+        "--lite",
+        action="store_true",
+        help="stream the annotations without pycocotools (only bbox related fields)",
+    )
+    parser.add_argument(
+        "-s",
+        "--segment",
+        action="store_true",
+        help="also write YOLO-seg polygon labels (iscrowd RLE masks are decoded to contours)",
+    )
     opt = parser.parse_args()
 
-    coco_to_yolo(opt.image_path, opt.label_path, opt.output_path)
+    coco_to_yolo(
+        opt.image_path,
+        opt.label_path,
+        opt.output_path,
+        opt.image_major,
+        opt.lite,
+        opt.segment,
+    )
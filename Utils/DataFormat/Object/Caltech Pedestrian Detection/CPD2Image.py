@@ -1,21 +1,127 @@
 # Caltech Pedestrian Detection数据集数据转换为可见图片,而不是.seq文件
 
+import os
 import glob
+import mmap
 import logging
 import argparse
+import numpy as np
 from tqdm import tqdm
+from typing import Union
 from pathlib import Path
+from itertools import repeat
+from multiprocessing.pool import Pool
 
+NUM_THREADS = min(8, os.cpu_count())  # number of multiprocessing threads
 logging.basicConfig(format="%(levelname)s:%(message)s", level=logging.INFO)
 
+JFIF_MARKER = b"\xFF\xD8\xFF\xE0\x00\x10\x4A\x46\x49\x46"  # 每一帧JPEG图像的起始标志
 
-def seqs2images(input_path: str, output_path: str) -> None:
+
+def seq_frame_offsets(buffer) -> list:
+    """
+    在.seq文件的字节(或mmap)中搜索JFIF标志,得到每一帧图像的起始偏移,第一个标志之前的部分为.seq文件的头
+
+    Args:
+        buffer: .seq文件的bytes或mmap对象
+
+    Returns:
+        offsets: 每一帧的起始偏移,最后额外追加文件长度作为结束位置
+    """
+    offsets = []
+    pos = buffer.find(JFIF_MARKER)
+    while pos != -1:
+        offsets.append(pos)
+        pos = buffer.find(JFIF_MARKER, pos + len(JFIF_MARKER))
+    offsets.append(len(buffer))
+    return offsets
+
+
+def seq_frame_index(seq_file: Union[str, Path], cache: bool = True) -> np.ndarray:
+    """
+    获取.seq文件的帧索引(帧序号 -> 字节偏移, 长度),并以<name>.idx.npy的形式持久化保存在.seq文件旁边,
+    当索引文件比.seq文件旧或者与文件长度不一致时重新扫描
+
+    Args:
+        seq_file: .seq文件路径
+        cache: 是否读取和保存持久化的索引文件
+
+    Returns:
+        index: (N, 2)的int64数组,每一行为一帧的(offset, length),帧序号与seqs2images输出的CPD_%07d.jpg一致
+    """
+    seq_file = Path(seq_file)
+    index_file = seq_file.with_suffix(".idx.npy")
+    size = os.path.getsize(seq_file)
+    if cache and index_file.exists():
+        if index_file.stat().st_mtime >= seq_file.stat().st_mtime:
+            try:
+                index = np.load(index_file)
+            except (OSError, ValueError):  # 索引文件损坏时重新扫描
+                logging.warning("Broken frame index %s, rescan it" % index_file)
+            else:
+                # ^ 最后一帧应当结束于文件末尾
+                if index.shape[1:] == (2,) and (
+                    len(index) == 0 or int(index[-1].sum()) == size
+                ):
+                    return index
+    if size == 0:
+        index = np.zeros((0, 2), dtype=np.int64)
+    else:
+        with open(seq_file, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as mm:
+            offsets = np.array(seq_frame_offsets(mm), dtype=np.int64)
+        index = np.stack((offsets[:-1], np.diff(offsets)), axis=1)
+    if cache:
+        # 先写入临时文件再替换,避免中断或并发时留下不完整的索引文件
+        tmp_file = index_file.with_name(index_file.name + ".%d.tmp" % os.getpid())
+        try:
+            with open(tmp_file, "wb") as f:
+                np.save(f, index)
+            os.replace(tmp_file, index_file)
+        except OSError:  # 数据集目录只读时不保存索引
+            logging.warning("Can not save the frame index %s" % index_file)
+            if tmp_file.exists():
+                tmp_file.unlink()
+    return index
+
+
+def _seq2images(args: tuple) -> int:
+    """
+    将单个.seq文件转换为图片,供多进程调用
+
+    Args:
+        args: (.seq文件路径, 输出图片的路径)
+
+    Returns:
+        count: 输出的图片数量
+    """
+    x, output_path = args
+    parent_str = x.parent.name
+    parent_dir = output_path.joinpath(parent_str).joinpath(x.stem)
+    parent_dir.mkdir(exist_ok=True, parents=True)
+
+    if os.path.getsize(x) == 0:
+        return 0
+    # 使用mmap映射整个.seq文件,按照帧偏移直接切片写出,内存占用与文件大小无关
+    with open(x, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        offsets = seq_frame_offsets(mm)
+        with memoryview(mm) as view:
+            for count, (start, end) in enumerate(zip(offsets[:-1], offsets[1:])):
+                file_path = parent_dir.joinpath("CPD_%07d.jpg" % count)  # ^ 可修改输出的名称补零长度
+                with open(file_path, "wb+") as img:
+                    img.write(view[start:end])
+    return len(offsets) - 1
+
+
+def seqs2images(input_path: str, output_path: str, workers: int = NUM_THREADS) -> None:
     """
     读取目录下所有的.seq文件,将其转换为实际的图片
 
     Args:
         input_path: 输入路径,该路径下包括set00到set10的所有数据集的解压数据,下面包含.set数据
         output_path: 输出图片的路径
+        workers: 同时处理的.seq文件数量,小于等于1时逐个处理
 
     Returns:
         None
@@ -28,29 +134,22 @@ def seqs2images(input_path: str, output_path: str) -> None:
     files = glob.glob(str(input_path.joinpath("**")), recursive=True)
     files = [Path(x) for x in files if x.split(".")[-1].lower() == "seq"]  # 获取seq文件图像路径
 
-    for x in tqdm(files, desc="Geting the images!", unit="imgs"):
-        parent_str = x.parent.name
-        parent_dir = output_path.joinpath(parent_str).joinpath(x.stem)
-        parent_dir.mkdir(exist_ok=True, parents=True)
-
-        with open(x, "rb") as f:
-            string = str(f.read().decode("latin-1"))  # 这里由于编码格式的问题,必须使用外国的latin-1解码
-            splitstring = "\xFF\xD8\xFF\xE0\x00\x10\x4A\x46\x49\x46"
-            strlist = string.split(splitstring)
-        count = -1
-        # 处理文件分段,除了第一个分段,每一个分段都是一张图
-        # deal with file segment, every segment is an image except the first one
-        for img in strlist:
-            file_path = parent_dir.joinpath("CPD_%07d.jpg" % count)  # ^ 可修改输出的名称补零长度
-            # 抛弃第一个代表的.seq文件的头
-            # abandon the first one, which is filled with .seq header
-            if count != -1:
-                with open(file_path, "wb+") as f:
-                    f.write(splitstring.encode("latin-1"))  # 同上编码
-                    f.write(img.encode("latin-1"))  # 同上编码
-            count += 1
-
-    logging.info("All Finish! (*╹▽╹*),HaHa~")
+    args = zip(files, repeat(output_path))
+    total = 0
+    pool = Pool(workers) if workers > 1 else None
+    try:
+        results = (
+            pool.imap_unordered(_seq2images, args) if pool else map(_seq2images, args)
+        )
+        pbar = tqdm(results, desc="Geting the images!", total=len(files), unit="seqs")
+        for count in pbar:
+            total += count
+            pbar.set_postfix(imgs=total)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    logging.info("All Finish! (*╹▽╹*),HaHa~ Got %d images" % total)
 
 
 if __name__ == "__main__":
@@ -75,6 +174,14 @@ if __name__ == "__main__":
         help="Caltech Pedestrian Detection Dataset output path to get images",
         metavar="output_images_path",
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=NUM_THREADS,
+        help="number of .seq files processed at the same time",
+        metavar="workers",
+    )
     opt = parser.parse_args()
 
-    seqs2images(opt.input_path, opt.output_path)
+    seqs2images(opt.input_path, opt.output_path, opt.workers)
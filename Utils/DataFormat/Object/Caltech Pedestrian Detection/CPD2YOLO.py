@@ -1,6 +1,8 @@
 # 将Caltech Pedestrian Detection数据集的VBB标注文件转换为YOLOv5格式
 
+import os
 import glob
+import mmap
 import shutil
 import logging
 import argparse
@@ -8,25 +10,64 @@ import numpy as np
 from tqdm import tqdm
 from typing import Union
 from pathlib import Path
+from itertools import repeat
+from multiprocessing.pool import Pool
 from scipy.io import loadmat
+from CPD2Image import seq_frame_index
 
-
+NUM_THREADS = min(8, os.cpu_count())  # number of multiprocessing threads
 logging.basicConfig(format="%(levelname)s:%(message)s", level=logging.INFO)
 
 
+VBB_COLUMNS = ("frame", "id", "x", "y", "w", "h", "occl")  # _vbb_flatten输出数组的列
+
+
+def _vbb_flatten(vbb_file: Union[str, Path]) -> tuple:
+    """
+    读取单独的.vbb文件,将所有帧中的所有目标展开为一个二维数组,便于使用数组掩码进行过滤
+
+    Args:
+        vbb_file: 输入文件绝对路径,该文件为后缀的.vbb的标签文件
+
+    Returns:
+        (objects, objLbl): objects为(M, 7)的float64数组,列为VBB_COLUMNS,id从0开始;objLbl为所有类别
+    """
+    vbb = loadmat(vbb_file)  # Matlab Mat
+    # object info in each frame: id, pos, occlusion, lock, posv
+    objLists = vbb["A"][0][0][1][0]  # 得到每一帧图的目标检测类别
+    objLbl = [str(v[0]) for v in vbb["A"][0][0][4][0]]  # 可查看所有类别
+    frames, ids, poses, occls = [], [], [], []
+    for frame_id, obj in enumerate(objLists):
+        if obj.size == 0:  # 序列图中可能没有人的目标
+            continue
+        objs = obj[0]
+        frames.append(np.full(len(objs), frame_id))
+        ids.extend(objs["id"])
+        poses.extend(objs["pos"])
+        occls.extend(objs["occl"])
+    if not frames:
+        return np.zeros((0, len(VBB_COLUMNS))), objLbl
+    objects = np.empty((len(ids), len(VBB_COLUMNS)))
+    objects[:, 0] = np.concatenate(frames)
+    objects[:, 1] = np.concatenate(ids, axis=None) - 1  # Maltab索引从1开始,而不是零
+    objects[:, 2:6] = np.concatenate(poses, axis=0).reshape(-1, 4)
+    objects[:, 6] = np.concatenate(occls, axis=None)
+    return objects, objLbl
+
+
 def _vbb_anno2dict(
     vbb_file: Union[str, Path],
     images_output_path: Path,
-    image_input_path: Path,
+    image_input_path: Union[Path, None],
     filter_area: Union[float, int] = 600,
-) -> None:
+) -> dict:
     """
     读取目录下单独的.vbb文件,处理获取该.vbb文件对应的的.seq图像序列中的数据,并过滤比较小的面积目标
 
     Args:
         vbb_file: 输入文件绝对路径,该文件为后缀的.vbb的标签文件
         images_output_path: 输入图像路径,该路径为通过CPD2Image.py脚本处理后得到的图像数据路径,该路径便于根据处理情况筛选有标签的图像
-        image_input_path: 输出路径,该路径下包括标准的YOLOv5格式的images和labels文件夹
+        image_input_path: 输出路径,该路径下包括标准的YOLOv5格式的images和labels文件夹,为None时不记录src_img_path
         filter_area: 过滤标签的面积,从而避免较小的标签
 
     Returns:
@@ -34,66 +75,140 @@ def _vbb_anno2dict(
     """
     #! 人太小了根本就看不清,设定就是600个像素单位作为过滤
     annos = {}
-    vbb = loadmat(vbb_file)  # Matlab Mat
     images_output_path.mkdir(exist_ok=True, parents=True)
-    # object info in each frame: id, pos, occlusion, lock, posv
-    objLists = vbb["A"][0][0][1][0]  # 得到每一帧图的目标检测类别
-    objLbl = [str(v[0]) for v in vbb["A"][0][0][4][0]]  # 可查看所有类别
+    objects, objLbl = _vbb_flatten(vbb_file)
     # person index
     person_index_list = np.where(np.array(objLbl) == "person")[0]  # 只选取类别为'person'的类别
-    for frame_id, obj in enumerate(objLists):
-        if len(obj) > 0:  # 序列图中可能没有人的目标
-            frame_name = images_output_path.joinpath(
-                vbb_file.parent.name + "_" + vbb_file.stem + "_CPD_%07d.jpg" % frame_id
-            )
-            frame_dict = {
-                frame_name: {
-                    "label": "person",
-                    "occlusion": [],  # 0为未遮挡,1为遮挡 #^ 当前标签还未使用
-                    "bbox": [],
-                    "src_img_path": image_input_path.joinpath(vbb_file.parent.name)
-                    .joinpath(vbb_file.stem)
-                    .joinpath("CPD_%07d.jpg" % frame_id),
-                }
-            }
-            for id, pos, occl in zip(obj["id"][0], obj["pos"][0], obj["occl"][0]):
-                id = int(id[0][0]) - 1  # Maltab索引从1开始,而不是零
-                if not id in person_index_list:  # 仅使用person标签的类别
-                    continue
-                pos = pos[0].tolist()
-                area = pos[2] * pos[3]
-                if area < filter_area:  # filter
-                    continue
-                occl = int(occl[0][0])
-                frame_dict[frame_name]["occlusion"].append(occl)
-                frame_dict[frame_name]["bbox"].append(pos)
-
-            if frame_dict[frame_name]["bbox"]:
-                annos.update(frame_dict)
+    keep = np.isin(objects[:, 1], person_index_list)  # 仅使用person标签的类别
+    keep &= objects[:, 4] * objects[:, 5] >= filter_area  # filter
+    objects = objects[keep]
+    if not len(objects):
+        return annos
+
+    # 整体计算YOLO格式的xywh并一次性格式化为文本
+    xywh = np.empty((len(objects), 4))
+    xywh[:, 0] = (objects[:, 2] + objects[:, 4] / 2) / 640  # 数据集像素宽度640
+    xywh[:, 1] = (objects[:, 3] + objects[:, 5] / 2) / 480  # 数据集像素高度480
+    xywh[:, 2] = objects[:, 4] / 640
+    xywh[:, 3] = objects[:, 5] / 480
+    lines = ["0 %.6f %.6f %.6f %.6f\n" % tuple(x) for x in xywh.tolist()]  #! 这里的0仅代表一类,即行人
+
+    # 按照帧分组,frame列本身有序
+    frame_ids, starts = np.unique(objects[:, 0], return_index=True)
+    ends = np.append(starts[1:], len(objects))
+    for frame_id, start, end in zip(frame_ids.astype(int).tolist(), starts, ends):
+        frame_name = images_output_path.joinpath(
+            vbb_file.parent.name + "_" + vbb_file.stem + "_CPD_%07d.jpg" % frame_id
+        )
+        annos[frame_name] = {
+            "label": "person",
+            "occlusion": objects[start:end, 6].astype(int).tolist(),  # 0为未遮挡,1为遮挡 #^ 当前标签还未使用
+            "bbox": objects[start:end, 2:6].tolist(),
+            "label_str": "".join(lines[start:end]),
+            "src_img_path": (
+                image_input_path.joinpath(vbb_file.parent.name)
+                .joinpath(vbb_file.stem)
+                .joinpath("CPD_%07d.jpg" % frame_id)
+                if image_input_path is not None
+                else None
+            ),
+            "frame_id": frame_id,
+        }
     return annos
 
 
+def _seq_extract_frames(seq_file: Path, annos: dict) -> None:
+    """
+    根据.seq文件的帧索引,直接从.seq中提取有标签的帧并保存,跳过其余无用的帧
+
+    Args:
+        seq_file: .vbb标签对应的.seq文件路径
+        annos: _vbb_anno2dict得到的标签字典,键为输出图像路径
+
+    Returns:
+        None
+    """
+    index = seq_frame_index(seq_file)
+    with open(seq_file, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mm:
+        with memoryview(mm) as view:
+            for filename, anno in annos.items():
+                offset, length = index[anno["frame_id"]].tolist()
+                with open(filename, "wb") as img:
+                    img.write(view[offset : offset + length])
+
+
+def _vbb2yolo(args: tuple) -> int:
+    """
+    处理单独的.vbb文件,写出YOLO格式标签并获取对应的图像,供多进程调用
+
+    Args:
+        args: (vbb_file, images_output_path, labels_output_path, image_input_path, filter_area, seq_input_path)
+
+    Returns:
+        count: 输出的图像数量
+    """
+    (
+        vbb_file,
+        images_output_path,
+        labels_output_path,
+        image_input_path,
+        filter_area,
+        seq_input_path,
+    ) = args
+    annos = _vbb_anno2dict(vbb_file, images_output_path, image_input_path, filter_area)
+    if annos and seq_input_path is not None:
+        seq_file = (
+            Path(seq_input_path)
+            .joinpath(vbb_file.parent.name)
+            .joinpath(vbb_file.stem + ".seq")
+        )
+        _seq_extract_frames(seq_file, annos)
+    for filename, anno in annos.items():
+        with open(
+            labels_output_path.joinpath(filename.stem + ".txt"),
+            "w",
+            encoding="utf-8",
+        ) as f:
+            f.write(anno["label_str"])
+        if seq_input_path is None:
+            shutil.copy(anno["src_img_path"], filename)
+    return len(annos)
+
+
 def vbb2yolo(
     input_path: str,
-    image_input_path: str,
+    image_input_path: Union[str, None],
     output_path: str,
     filter_area: Union[float, int],
+    seq_input_path: Union[str, None] = None,
+    workers: int = NUM_THREADS,
 ) -> None:
     """
     读取目录下所有的.vbb文件,将根据转换得到的数据信息,进行图像的复制和标签的获取
 
     Args:
         input_path: 输入路径,该路径下包括set00到set10的所有数据集的解压标签数据,下面包含.vbb数据
-        image_input_path: 输入图像路径,该路径为通过CPD2Image.py脚本处理后得到的图像数据路径,该路径便于根据处理情况筛选有标签的图像
+        image_input_path: 输入图像路径,该路径为通过CPD2Image.py脚本处理后得到的图像数据路径,该路径便于根据处理情况筛选有标签的图像,
+                          给定seq_input_path时不使用,可以为None
         output_path: 输出路径,该路径下包括标准的YOLOv5格式的images和labels文件夹
         filter_area: 过滤标签的面积,从而避免较小的标签
+        seq_input_path: .seq文件的根目录(包含set00到set10),给定时根据帧索引直接从.seq中提取有标签的帧,不再需要CPD2Image.py的输出
+        workers: 多进程处理.vbb文件的进程数
 
     Returns:
         None
     """
     input_path = Path(input_path)
     assert input_path.is_dir(), f"{str(input_path)} is not a path!"
-    image_input_path = Path(image_input_path)
+    if seq_input_path is None:
+        assert (
+            image_input_path is not None
+        ), "image_input_path or seq_input_path is needed!"
+        image_input_path = Path(image_input_path)
+    else:
+        image_input_path = None  # ^ 直接从.seq中提取帧,不需要CPD2Image.py的输出
     output_path = Path(output_path)
     images_output_path = output_path.joinpath("images")
     labels_output_path = output_path.joinpath("labels")
@@ -105,41 +220,25 @@ def vbb2yolo(
         Path(x) for x in vbb_files if x.split(".")[-1].lower() == "vbb"
     ]  # 获取seq文件图像路径
 
-    # TODO 多进程加速数据获取
-    for vbb_file in tqdm(
-        vbb_files, desc="Geting the YOLOv5 format images and labels", unit="labels"
-    ):
-        annos = _vbb_anno2dict(
-            vbb_file, images_output_path, image_input_path, filter_area
+    args = zip(
+        vbb_files,
+        repeat(images_output_path),
+        repeat(labels_output_path),
+        repeat(image_input_path),
+        repeat(filter_area),
+        repeat(seq_input_path),
+    )
+    total = 0
+    with Pool(workers) as pool:
+        pbar = tqdm(
+            pool.imap_unordered(_vbb2yolo, args),
+            desc="Geting the YOLOv5 format images and labels",
+            total=len(vbb_files),
+            unit="labels",
         )
-        if annos:
-            for filename, anno in sorted(annos.items(), key=lambda x: x[0]):
-                label_str = ""
-                for bbox in anno["bbox"]:
-                    x_center = (bbox[0] + bbox[2] / 2) / 640  # 数据集像素宽度640
-                    y_center = (bbox[1] + bbox[3] / 2) / 480  # 数据集像素高度480
-                    width = bbox[2] / 640
-                    height = bbox[3] / 480
-                    label_str = (
-                        label_str
-                        + "0 "
-                        + " ".join(
-                            (
-                                "%.6f" % x_center,
-                                "%.6f" % y_center,
-                                "%.6f" % width,
-                                "%.6f" % height,
-                            )
-                        )
-                        + "\n"
-                    )  #! 这里的0仅代表一类,即行人
-                with open(
-                    labels_output_path.joinpath(filename.stem + ".txt"),
-                    "w",
-                    encoding="utf-8",
-                ) as f:
-                    f.write(label_str)
-                shutil.copy(anno["src_img_path"], filename)
+        for count in pbar:
+            total += count
+            pbar.set_postfix(imgs=total)
 
     logging.info(
         "All Finish! (*╹▽╹*),HaHa~ There are so many images that are useless! You should just get part of it!"
@@ -184,6 +283,29 @@ if __name__ == "__main__":
         help="Caltech Pedestrian Detection Dataset filter area to get big enough label",
         metavar="label_filter_area",
     )
+    parser.add_argument(
+        "-seq",
+        "--seq_input_path",
+        type=str,
+        default=None,
+        help="Caltech Pedestrian Detection Dataset .seq dir, extract labeled frames directly instead of using --image_input_path",
+        metavar="CPD_seq_dir",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=NUM_THREADS,
+        help="number of processes to handle .vbb files",
+        metavar="workers",
+    )
     opt = parser.parse_args()
 
-    vbb2yolo(opt.input_path, opt.image_input_path, opt.output_path, opt.filter_area)
+    vbb2yolo(
+        opt.input_path,
+        opt.image_input_path,
+        opt.output_path,
+        opt.filter_area,
+        opt.seq_input_path,
+        opt.workers,
+    )
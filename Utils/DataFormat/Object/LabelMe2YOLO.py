@@ -1,10 +1,11 @@
 # VOC的xml格式转换为YOLO的xywh格式
 
-import json
 import logging
 import argparse
-from tqdm import tqdm
+from typing import Union
 from pathlib import Path
+from labelme_reader import NUM_THREADS, read_labelme_batch
+from label_schema import LabelSchema, load_label_dicts
 
 logging.basicConfig(format="%(levelname)s:%(message)s", level=logging.INFO)
 
@@ -17,7 +18,13 @@ OBJECT_DICT = {
 }
 
 
-def labelme2yolo(input_path: str, output_path: str, count_output_file: str) -> None:
+def labelme2yolo(
+    input_path: str,
+    output_path: str,
+    count_output_file: str,
+    workers: int = NUM_THREADS,
+    schema_file: Union[str, None] = None,
+) -> None:
     """
     将LabelMe的json格式数据转换为YOLOv5的xywh格式
 
@@ -25,6 +32,8 @@ def labelme2yolo(input_path: str, output_path: str, count_output_file: str) -> N
         input_path: 输入json标签的路径
         output_path: 输出txt标签的路径
         count_output_file: 统计文件的绝对路径
+        workers: 读取json的进程数
+        schema_file: 外部YAML标签定义文件(包含OBJECT_DICT),为None时使用本文件中的定义
 
     Returns:
         None
@@ -33,32 +42,23 @@ def labelme2yolo(input_path: str, output_path: str, count_output_file: str) -> N
     output_path = Path(output_path)
     output_path.mkdir(exist_ok=True, parents=True)
 
-    # 类别统计
-    object_dict = {}
-    for key in OBJECT_DICT.keys():
-        object_dict[key] = 0
-    object_dict["other"] = 0  # 其他第三方类别
+    label_dict = OBJECT_DICT
+    if schema_file is not None:
+        label_dict = load_label_dicts(schema_file)["OBJECT_DICT"]
+    schema = LabelSchema(label_dict)  # 其他第三方类别统计为other
+    indices = []  # 类别统计
 
     logging.info("Getting the json labels")
     files = list(input_path.glob("*.json"))  # 仅读取json
 
-    for label_file in tqdm(
-        files, desc="Changing LabelMe json format to YOLO format!", unit="jsons"
+    for label_file, (width, height, shapes) in read_labelme_batch(
+        files, workers, desc="Changing LabelMe json format to YOLO format!"
     ):
-        with open(label_file, "r", encoding="utf-8") as f:
-            json_str = json.load(f)
-        width = json_str["imageWidth"]
-        height = json_str["imageHeight"]
         label_str = ""
-        for x in json_str["shapes"]:
-            label_name = x["label"]
-            train_id = OBJECT_DICT[label_name]["train_id"]
-            # 标签名称转换和数量统计 #^ 这里根据实际情况修改
-            try:
-                object_dict[label_name] += 1
-            except:
-                object_dict["other"] += 1
-
+        for x in shapes:
+            index = schema.index[x["label"]]
+            indices.append(index)
+            train_id = schema.train_id(index)
             if train_id != -1:
                 x_cnetral = (x["points"][0][0] + x["points"][1][0]) / (2 * width)
                 y_central = (x["points"][0][1] + x["points"][1][1]) / (2 * height)
@@ -78,6 +78,7 @@ def labelme2yolo(input_path: str, output_path: str, count_output_file: str) -> N
             f.write(label_str)
 
     # 类别个数统计
+    object_dict = schema.count_dict(schema.bincount(indices))
     with open(count_output_file, "w", encoding="utf-8") as f:
         for key in object_dict.keys():
             f.write(key + ":" + str(object_dict[key]) + "\n")
@@ -116,6 +117,28 @@ if __name__ == "__main__":
         metavar="CA_count_output_path",
     )
 
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=NUM_THREADS,
+        help="number of processes for reading json files",
+        metavar="workers",
+    )
+    parser.add_argument(
+        "-s",
+        "--schema_file",
+        type=str,
+        default=None,
+        help="The YAML file of OBJECT_DICT label definition, use the definition in this file if not set",
+        metavar="schema_file",
+    )
     opt = parser.parse_args()
 
-    labelme2yolo(opt.input_path, opt.output_path, opt.count_output_file)
+    labelme2yolo(
+        opt.input_path,
+        opt.output_path,
+        opt.count_output_file,
+        opt.workers,
+        opt.schema_file,
+    )
@@ -2,10 +2,9 @@
 
 import os
 import argparse
-from tqdm import tqdm
 from typing import Union
 from pathlib import Path
-import xml.etree.ElementTree as ET
+from voc_reader import NUM_THREADS, read_voc_batch
 
 CLASSES = ["persoon", "car"]  #! 根据数据标注情况选取实际的需要的类别
 
@@ -36,6 +35,7 @@ def voc2yolo(
     width: Union[int, None] = None,
     height: Union[int, None] = None,
     save_difficult: bool = False,
+    workers: int = NUM_THREADS,
 ) -> None:
     """
     将VOC的xml格式数据转换为YOLOv5的xywh格式
@@ -46,53 +46,41 @@ def voc2yolo(
         width: 自行设置的覆盖内部XML宽高的宽
         height: 自行设置的覆盖内部XML宽高的高
         save_difficult: 是否保留难样例
+        workers: 读取xml的进程数
 
     Returns:
         None
     """
-    for file in tqdm(
-        os.listdir(input_path), desc="Changing VOC format to YOLO format!", unit="xmls"
-    ):
+    xml_files = []
+    for file in os.listdir(input_path):
         label_file = input_path + os.sep + file
         if (
             os.path.isfile(label_file) and Path(label_file).suffix.lower()[1:] == "xml"
         ):  # 指定仅读取xml
-            with open(
-                output_path + os.sep + file.replace("xml", "txt"), "w"
-            ) as out_file:
-                tree = ET.parse(label_file)
-                root = tree.getroot()
-                size = root.find("size")
-                w = int(
-                    size.find("width").text
-                )  #! 原始VOC中宽高可能存在为零的问题,通过自行设置width和height覆盖解决这个问题
-                h = int(size.find("height").text)
-                if width:
-                    w = width
-                if height:
-                    h = height
+            xml_files.append(file)
 
-                for obj in root.iter("object"):
-                    difficult = obj.find("difficult").text
-                    cls = obj.find("name").text
-                    if save_difficult:  # 是否过滤难样例
-                        if cls not in CLASSES:
-                            continue
-                    else:
-                        if cls not in CLASSES or int(difficult) == 1:
-                            continue
-                    cls_id = CLASSES.index(cls)
-                    bndbox = obj.find("bndbox")
-                    box = [
-                        float(bndbox.find("xmin").text),
-                        float(bndbox.find("ymin").text),
-                        float(bndbox.find("xmax").text),
-                        float(bndbox.find("ymax").text),
-                    ]
-                    bbox = xyxy2xywh((w, h), box)
-                    out_file.write(
-                        str(cls_id) + " " + " ".join("%.6f" % x for x in bbox) + "\n"
-                    )
+    #! 原始VOC中宽高可能存在为零的问题,通过自行设置width和height覆盖解决这个问题
+    for file, (w, h, objects) in read_voc_batch(
+        [input_path + os.sep + x for x in xml_files],
+        width,
+        height,
+        workers,
+        desc="Changing VOC format to YOLO format!",
+    ):
+        file = os.path.basename(file)
+        lines = []
+        for cls, difficult, box in objects:
+            if save_difficult:  # 是否过滤难样例
+                if cls not in CLASSES:
+                    continue
+            else:
+                if cls not in CLASSES or difficult == 1:
+                    continue
+            cls_id = CLASSES.index(cls)
+            bbox = xyxy2xywh((w, h), box)
+            lines.append(str(cls_id) + " " + " ".join("%.6f" % x for x in bbox) + "\n")
+        with open(output_path + os.sep + file.replace("xml", "txt"), "w") as out_file:
+            out_file.write("".join(lines))
 
 
 if __name__ == "__main__":
@@ -130,6 +118,14 @@ if __name__ == "__main__":
         help="the image height, it will cover the height in xml file!",
         metavar="cover_height",
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=NUM_THREADS,
+        help="number of processes for reading xml files",
+        metavar="workers",
+    )
     # 便于在IDE中运行
     # parser.add_argument('-i', '--input_path', type=str, default='./', help='the file input path of VOC format to yolov5 format!', metavar='voc_input_path')
     # parser.add_argument('-o', '--output_path', type=str, default='./', help='the file output path of VOC format to yolov5 format!', metavar='voc_output_path')
@@ -139,4 +135,6 @@ if __name__ == "__main__":
     opt = parser.parse_args()
 
     os.makedirs(opt.output_path, exist_ok=True)
-    voc2yolo(opt.input_path, opt.output_path, opt.width, opt.height)
+    voc2yolo(
+        opt.input_path, opt.output_path, opt.width, opt.height, workers=opt.workers
+    )
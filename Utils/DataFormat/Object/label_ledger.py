@@ -0,0 +1,294 @@
+# 标签数量统计账本,使用SQLite(WAL模式)记录每一次转换的类别数量,支持多个转换同时写入同一个统计文件,
+# 并导出与原先统计文本(label:count)一致的格式,供CATrafficLight2YOLO.py使用
+
+import os
+import time
+import sqlite3
+import argparse
+from typing import Union
+from pathlib import Path
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created REAL NOT NULL,
+    tool TEXT NOT NULL,
+    source TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS counts (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    label TEXT NOT NULL,
+    count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS counts_label ON counts(label);
+"""
+
+
+def read_count_text(count_file: Union[str, Path]) -> dict:
+    """
+    读取label:count格式的统计文本
+
+    Args:
+        count_file: 统计文本路径
+
+    Returns:
+        {label: count}
+    """
+    counts = {}
+    with open(count_file, "r", encoding="utf-8") as f:
+        for x in f.readlines():
+            if not x.strip():
+                continue
+            label, count = x.split(":", 1)
+            counts[label] = counts.get(label, 0) + int(count)
+    return counts
+
+
+class LabelLedger:
+    """
+    类别数量统计账本,每一次转换作为一个run插入,所有写入均在事务中完成
+    """
+
+    def __init__(self, db_path: Union[str, Path], timeout: float = 60) -> None:
+        """
+        Args:
+            db_path: SQLite数据库路径
+            timeout: 等待其他进程释放写锁的时间(秒)
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(exist_ok=True, parents=True)
+        self.conn = sqlite3.connect(
+            str(self.db_path), timeout=timeout, isolation_level=None
+        )  # ^ 手动管理事务
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA_SQL)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _insert_run(self, tool: str, source: str, counts: dict) -> int:
+        cursor = self.conn.execute(
+            "INSERT INTO runs (created, tool, source) VALUES (?, ?, ?)",
+            (time.time(), tool, source),
+        )
+        run_id = cursor.lastrowid
+        self.conn.executemany(
+            "INSERT INTO counts (run_id, label, count) VALUES (?, ?, ?)",
+            [(run_id, label, int(count)) for label, count in counts.items()],
+        )
+        return run_id
+
+    def _delete_runs(
+        self, tool: Union[str, None] = None, source: Union[str, None] = None
+    ) -> None:
+        conditions, params = [], []
+        if tool is not None:
+            conditions.append("tool = ?")
+            params.append(tool)
+        if source is not None:
+            conditions.append("source = ?")
+            params.append(source)
+        where = (" WHERE " + " AND ".join(conditions)) if conditions else ""
+        self.conn.execute(
+            "DELETE FROM counts WHERE run_id IN (SELECT run_id FROM runs%s)" % where,
+            params,
+        )
+        self.conn.execute("DELETE FROM runs" + where, params)
+
+    def record(
+        self,
+        counts: dict,
+        tool: str = "",
+        source: str = "",
+        export_file: Union[str, Path, None] = None,
+        labels: Union[list, None] = None,
+        replace: bool = False,
+        reset_if_missing: bool = False,
+    ) -> int:
+        """
+        在一个写事务中插入一次转换的类别数量,并可选地导出统计文本,导出与插入持有同一把写锁,不会互相覆盖
+
+        Args:
+            counts: {label: count}
+            tool: 转换函数名称
+            source: 转换的输入文件或目录
+            export_file: 导出的统计文本路径,为None时不导出
+            labels: 导出时优先按照该顺序输出的类别
+            replace: 是否删除相同tool和source之前的run,重复运行同一转换时替换而不是累加
+            reset_if_missing: export_file不存在(被删除)时是否先清空账本,统计从零开始
+
+        Returns:
+            run_id
+        """
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            if (
+                reset_if_missing
+                and export_file is not None
+                and not Path(export_file).exists()
+            ):
+                self._delete_runs()
+            if replace:
+                self._delete_runs(tool, source)
+            run_id = self._insert_run(tool, source, counts)
+            if export_file is not None:
+                self.export_text(export_file, labels)
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return run_id
+
+    def import_text(self, count_file: Union[str, Path]) -> bool:
+        """
+        账本为空时将已有的统计文本作为一次run导入,保证从文本统计切换到账本后数量继续累加
+
+        Args:
+            count_file: 原有的统计文本路径
+
+        Returns:
+            是否导入
+        """
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            empty = self.conn.execute("SELECT COUNT(*) FROM runs").fetchone()[0] == 0
+            imported = empty and Path(count_file).exists()
+            if imported:
+                self._insert_run(
+                    "import_text", str(count_file), read_count_text(count_file)
+                )
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return imported
+
+    def totals(
+        self, run_id: Union[int, None] = None, source: Union[str, None] = None
+    ) -> dict:
+        """
+        查询类别数量总和
+
+        Args:
+            run_id: 只统计某一次run
+            source: 只统计某一个输入文件或目录
+
+        Returns:
+            {label: count},按照类别首次出现的顺序
+        """
+        sql = "SELECT label, SUM(count) FROM counts JOIN runs USING (run_id)"
+        conditions, params = [], []
+        if run_id is not None:
+            conditions.append("run_id = ?")
+            params.append(run_id)
+        if source is not None:
+            conditions.append("source = ?")
+            params.append(source)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " GROUP BY label ORDER BY MIN(counts.rowid)"
+        return dict(self.conn.execute(sql, params).fetchall())
+
+    def runs(self) -> list:
+        """
+        查询所有的run
+
+        Returns:
+            [(run_id, created, tool, source, total)]
+        """
+        return self.conn.execute(
+            "SELECT run_id, created, tool, source, COALESCE(SUM(count), 0) "
+            "FROM runs LEFT JOIN counts USING (run_id) GROUP BY run_id ORDER BY run_id"
+        ).fetchall()
+
+    def export_text(
+        self, count_file: Union[str, Path], labels: Union[list, None] = None
+    ) -> None:
+        """
+        导出label:count格式的统计文本,先写临时文件再替换,避免读取到写了一半的文件
+
+        Args:
+            count_file: 统计文本路径
+            labels: 优先按照该顺序输出的类别(没有记录的类别输出0),其余类别按照首次出现的顺序追加
+        """
+        totals = self.totals()
+        labels = list(labels or [])
+        known = set(labels)
+        labels += [label for label in totals if label not in known]
+        count_file = Path(count_file)
+        tmp_file = count_file.with_name(count_file.name + ".%d.tmp" % os.getpid())
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            for label in labels:
+                f.write(label + ":" + str(totals.get(label, 0)) + "\n")
+        os.replace(tmp_file, count_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Query the label statistics ledger!",
+        epilog="Count them all!",
+    )
+    parser.add_argument(
+        "-d",
+        "--db_path",
+        type=str,
+        required=True,
+        help="The SQLite ledger path",
+        metavar="db_path",
+    )
+    parser.add_argument(
+        "-r",
+        "--run_id",
+        type=int,
+        default=None,
+        help="Only count the given run",
+        metavar="run_id",
+    )
+    parser.add_argument(
+        "-s",
+        "--source",
+        type=str,
+        default=None,
+        help="Only count the given source file or dir",
+        metavar="source",
+    )
+    parser.add_argument(
+        "-l",
+        "--list_runs",
+        action="store_true",
+        help="List all runs instead of label totals",
+    )
+    parser.add_argument(
+        "-e",
+        "--export_file",
+        type=str,
+        default=None,
+        help="Export the label totals to label:count text file",
+        metavar="export_file",
+    )
+    opt = parser.parse_args()
+
+    with LabelLedger(opt.db_path) as ledger:
+        if opt.list_runs:
+            for run_id, created, tool, source, total in ledger.runs():
+                print(
+                    "%d\t%s\t%s\t%s\t%d"
+                    % (
+                        run_id,
+                        time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(created)),
+                        tool,
+                        source,
+                        total,
+                    )
+                )
+        elif opt.export_file:
+            ledger.export_text(opt.export_file)
+        else:
+            for label, count in ledger.totals(opt.run_id, opt.source).items():
+                print(label + ":" + str(count))
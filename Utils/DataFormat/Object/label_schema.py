@@ -0,0 +1,109 @@
+# 标签定义字典(Name: ID, TrainID, TypeID)的编译,启动时一次性转换为整数索引和NumPy数组,
+# 供CATrafficLight2YOLO.py, LabelMe2YOLO.py和JointMultiTask/CA_MultiTask_Process.py共用
+
+import sys
+import numpy as np
+from typing import Union
+from pathlib import Path
+
+OTHER = "other"  # 不在统计类别中的标签统一计入other
+
+
+class LabelSchema:
+    """
+    编译后的标签定义,名称通过index映射为整数索引,索引对应ids, train_ids, type_ids和buckets数组,
+    类别统计时只需要记录索引,最终通过bincount得到每个统计类别的数量
+    """
+
+    def __init__(
+        self,
+        label_dict: dict,
+        count_names: Union[list, None] = None,
+        train_id_buckets: Union[dict, None] = None,
+    ) -> None:
+        """
+        Args:
+            label_dict: 标签定义字典,格式为{name: {"id": ID, "train_id": TrainID, "type_id": TypeID}}
+            count_names: 统计输出的类别名称,默认为label_dict的所有名称,不在其中的标签计入other
+            train_id_buckets: {train_id: 统计类别名称},某些train_id的标签合并统计为同一个类别
+        """
+        self.names = tuple(sys.intern(name) for name in label_dict.keys())
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.ids = np.array([v["id"] for v in label_dict.values()], dtype=np.int32)
+        self.train_ids = np.array(
+            [v["train_id"] for v in label_dict.values()], dtype=np.int32
+        )
+        self.type_ids = np.array(
+            [v["type_id"] for v in label_dict.values()], dtype=np.int32
+        )
+        # 统计类别,与原先的if/elif分支和try/except计数一致
+        if count_names is None:
+            count_names = list(self.names)
+        self.count_names = list(count_names)
+        if OTHER not in self.count_names:
+            self.count_names.append(OTHER)
+        count_index = {name: i for i, name in enumerate(self.count_names)}
+        train_id_buckets = train_id_buckets or {}
+        self.buckets = np.array(
+            [
+                (
+                    count_index[train_id_buckets[train_id]]
+                    if train_id in train_id_buckets
+                    else count_index.get(name, count_index[OTHER])
+                )
+                for name, train_id in zip(self.names, self.train_ids.tolist())
+            ],
+            dtype=np.int32,
+        )
+        # ^ 逐个标签取值时使用python列表,避免numpy标量
+        self._train_ids = self.train_ids.tolist()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.index
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def train_id(self, index: int) -> int:
+        """
+        获取索引对应的TrainID
+        """
+        return self._train_ids[index]
+
+    def bincount(self, indices: list) -> np.ndarray:
+        """
+        根据标签索引统计每个统计类别的数量
+
+        Args:
+            indices: 标签索引列表或数组
+
+        Returns:
+            counts: 长度为len(count_names)的int64数组
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        return np.bincount(self.buckets[indices], minlength=len(self.count_names))
+
+    def count_dict(self, counts: np.ndarray) -> dict:
+        """
+        将bincount的结果转换为{统计类别名称: 数量}的字典,顺序与count_names一致
+        """
+        return dict(zip(self.count_names, np.asarray(counts).tolist()))
+
+
+def load_label_dicts(yaml_file: Union[str, Path]) -> dict:
+    """
+    从YAML文件中读取标签定义,便于在不修改脚本的情况下调整定义,文件格式为:
+        TRAFFIC_LIGHT_ORIGIN:
+          red_circle_none: {id: 1, train_id: 3, type_id: 1}
+          ...
+
+    Args:
+        yaml_file: YAML文件路径
+
+    Returns:
+        {字典名称: 标签定义字典}
+    """
+    import yaml  # 仅在使用YAML定义时需要
+
+    with open(yaml_file, "r", encoding="utf-8") as f:
+        return yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
@@ -0,0 +1,107 @@
+# LabelMe标注json文件的快速读取,跳过内嵌的imageData图像数据,供LabelMe2YOLO.py与CATrafficLight2YOLO.py共用
+
+import os
+import json
+from tqdm import tqdm
+from typing import Union
+from pathlib import Path
+from multiprocessing.pool import Pool
+
+NUM_THREADS = min(8, os.cpu_count())  # number of multiprocessing threads
+
+IMAGE_DATA_KEY = b'"imageData"'
+
+
+def _skip_image_data(data: bytes) -> bytes:
+    """
+    在原始字节中定位imageData字段的字符串值并替换为null,避免json解析时构建数MB的base64字符串
+
+    Args:
+        data: json文件的原始字节
+
+    Returns:
+        去掉imageData值后的json字节
+    """
+    pos = data.find(IMAGE_DATA_KEY)
+    while pos != -1:
+        start = pos + len(IMAGE_DATA_KEY)
+        while data[start : start + 1].isspace():
+            start += 1
+        if data[start : start + 1] == b":":  # ^ 确认是字段名而不是某个字符串的值
+            start += 1
+            while data[start : start + 1].isspace():
+                start += 1
+            if data[start : start + 1] != b'"':  # 已经是null
+                return data
+            end = data.find(b'"', start + 1)
+            while end != -1:
+                backslash = end - 1
+                while data[backslash] == 0x5C:  # 反斜杠转义
+                    backslash -= 1
+                if (end - 1 - backslash) % 2 == 0:
+                    break
+                end = data.find(b'"', end + 1)
+            if end == -1:
+                return data
+            return data[:start] + b"null" + data[end + 1 :]
+        pos = data.find(IMAGE_DATA_KEY, start)
+    return data
+
+
+def read_labelme(json_file: Union[str, Path]) -> tuple:
+    """
+    读取LabelMe的json标签,仅返回imageWidth,imageHeight和shapes,不解析imageData
+
+    Args:
+        json_file: json标签路径
+
+    Returns:
+        (width, height, shapes)
+    """
+    with open(json_file, "rb") as f:
+        data = f.read()
+    json_str = json.loads(_skip_image_data(data).decode("utf-8"))
+    return json_str["imageWidth"], json_str["imageHeight"], json_str["shapes"]
+
+
+def _read_labelme(json_file: Union[str, Path]) -> tuple:
+    """
+    多进程读取的包装函数
+
+    Returns:
+        (json_file, (width, height, shapes))
+    """
+    return json_file, read_labelme(json_file)
+
+
+def read_labelme_batch(
+    json_files: list,
+    workers: int = NUM_THREADS,
+    desc: str = "Reading LabelMe json labels",
+):
+    """
+    使用进程池批量读取LabelMe的json标签,按照输入顺序返回结果
+
+    Args:
+        json_files: json标签路径列表
+        workers: 进程数,小于等于1时在当前进程中读取
+        desc: 进度条描述
+
+    Returns:
+        (json_file, (width, height, shapes))(生成器)
+    """
+    if workers <= 1:
+        yield from tqdm(
+            map(_read_labelme, json_files),
+            desc=desc,
+            total=len(json_files),
+            unit="jsons",
+        )
+        return
+    with Pool(workers) as pool:
+        yield from tqdm(
+            pool.imap(_read_labelme, json_files, chunksize=16),
+            desc=desc,
+            total=len(json_files),
+            unit="jsons",
+        )
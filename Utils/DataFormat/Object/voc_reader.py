@@ -0,0 +1,113 @@
+# VOC格式xml标签的快速读取,供VOC2YOLO.py与CATrafficLight2YOLO.py共用
+
+import os
+from tqdm import tqdm
+from typing import Union
+from pathlib import Path
+from itertools import repeat
+from multiprocessing.pool import Pool
+import xml.etree.ElementTree as ET
+
+NUM_THREADS = min(8, os.cpu_count())  # number of multiprocessing threads
+
+BNDBOX_TAGS = ("xmin", "ymin", "xmax", "ymax")
+
+
+def read_voc(
+    xml_file: Union[str, Path],
+    width: Union[int, None] = None,
+    height: Union[int, None] = None,
+) -> tuple:
+    """
+    使用iterparse读取单个VOC的xml标签,仅提取size,name,difficult和bndbox字段,不构建整个DOM树
+
+    Args:
+        xml_file: xml标签路径
+        width: 自行设置的覆盖内部XML宽高的宽,与height同时给定时不读取<size>节点
+        height: 自行设置的覆盖内部XML宽高的高
+
+    Returns:
+        (w, h, objects): 图像宽高和[(name, difficult, [xmin, ymin, xmax, ymax]), ...]
+    """
+    read_size = not (width and height)
+    w, h = width, height
+    objects = []
+    name, difficult, box = None, 0, [0.0] * 4
+    # 当前节点的标签路径,只读取<object>和<size>的直接子节点,忽略<part>等嵌套节点中的同名字段
+    path = []
+    root = None
+    for event, elem in ET.iterparse(str(xml_file), events=("start", "end")):
+        tag = elem.tag
+        if event == "start":
+            if root is None:
+                root = elem
+            path.append(tag)
+            if tag == "object":
+                name, difficult, box = None, 0, [0.0] * 4
+            continue
+        parent = path[-2] if len(path) > 1 else None
+        if parent == "object":
+            if tag == "name":
+                name = elem.text
+            elif tag == "difficult":
+                difficult = int(elem.text)
+        elif parent == "bndbox" and path[-3] == "object":
+            if tag in BNDBOX_TAGS:
+                box[BNDBOX_TAGS.index(tag)] = float(elem.text)
+        elif parent == "size" and len(path) == 3 and read_size:
+            if tag == "width" and not width:
+                w = int(elem.text)
+            elif tag == "height" and not height:
+                h = int(elem.text)
+        if tag == "object":
+            objects.append((name, difficult, box))
+            elem.clear()
+            root.clear()  # ^ 释放已经处理的节点,不构建整个DOM树
+        path.pop()
+    return w, h, objects
+
+
+def _read_voc(args: tuple) -> tuple:
+    """
+    多进程读取的包装函数
+
+    Returns:
+        (xml_file, (w, h, objects))
+    """
+    xml_file, width, height = args
+    return xml_file, read_voc(xml_file, width, height)
+
+
+def read_voc_batch(
+    xml_files: list,
+    width: Union[int, None] = None,
+    height: Union[int, None] = None,
+    workers: int = NUM_THREADS,
+    desc: str = "Reading VOC xml labels",
+):
+    """
+    使用进程池批量读取VOC的xml标签,按照输入顺序返回结果
+
+    Args:
+        xml_files: xml标签路径列表
+        width: 自行设置的覆盖内部XML宽高的宽
+        height: 自行设置的覆盖内部XML宽高的高
+        workers: 进程数,小于等于1时在当前进程中读取
+        desc: 进度条描述
+
+    Returns:
+        (xml_file, (w, h, objects))(生成器)
+    """
+    args = zip(xml_files, repeat(width), repeat(height))
+    if workers <= 1:
+        yield from tqdm(
+            map(_read_voc, args), desc=desc, total=len(xml_files), unit="xmls"
+        )
+        return
+    with Pool(workers) as pool:
+        yield from tqdm(
+            pool.imap(_read_voc, args, chunksize=64),
+            desc=desc,
+            total=len(xml_files),
+            unit="xmls",
+        )